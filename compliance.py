@@ -0,0 +1,146 @@
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, List
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import models
+import rollups
+
+# Checks that must be True on a healthy extinguisher
+EXPECTED_TRUE_CHECKS = [
+    "cylinder_nozzle",
+    "operating_lever",
+    "safety_pin",
+    "pressure_gauge",
+]
+
+# Checks that flag a defect when True
+EXPECTED_FALSE_CHECKS = [
+    "paint_peeled_off",
+    "presence_of_rust",
+    "damaged_cylinder",
+    "dent_on_body",
+]
+
+
+def latest_activity_id(is_number_column):
+    # Correlated subquery returning the id of the most recent inspection for an extinguisher.
+    # Served by the (is_number, inspection_date) index, so it only touches one index entry.
+    return (
+        select(models.MonthlyActivity.id)
+        .where(models.MonthlyActivity.is_number == is_number_column)
+        .order_by(models.MonthlyActivity.inspection_date.desc(), models.MonthlyActivity.id.desc())
+        .limit(1)
+        .correlate_except(models.MonthlyActivity)
+        .scalar_subquery()
+    )
+
+
+def unrecorded_latest_activities(*filters):
+    # Extinguishers that have no stored status yet (rebuild-compliance not run), each with its latest
+    # inspection, for callers that evaluate() them on the fly
+    return (
+        select(models.FireExtinguisher.is_number, models.MonthlyActivity)
+        .outerjoin(models.ComplianceStatus, models.ComplianceStatus.is_number == models.FireExtinguisher.is_number)
+        .outerjoin(models.MonthlyActivity, models.MonthlyActivity.id == latest_activity_id(models.FireExtinguisher.is_number))
+        .where(models.ComplianceStatus.is_number.is_(None), *filters)
+    )
+
+
+def failed_checks(activity) -> list:
+    failed = [attr for attr in EXPECTED_TRUE_CHECKS if not getattr(activity, attr)] + [
+        attr for attr in EXPECTED_FALSE_CHECKS if getattr(activity, attr)
+    ]
+
+    # Defects acknowledged in additional_info do not count against compliance
+    additional_info = activity.additional_info or {}
+    return [item for item in failed if item not in additional_info]
+
+
+def evaluate(activity):
+    # Returns (defects, non_compliant) for the latest inspection of an extinguisher
+    if activity is None:
+        # Never inspected counts as non-compliant
+        return [], True
+    defects = failed_checks(activity)
+    return defects, bool(defects)
+
+
+def initial_status(is_number: str) -> models.ComplianceStatus:
+    # Status row for a freshly registered extinguisher that has no inspections yet
+    return models.ComplianceStatus(
+        is_number=is_number,
+        latest_activity_id=None,
+        defects=[],
+        non_compliant=True,
+        computed_at=datetime.utcnow(),
+    )
+
+
+def refresh_compliance(db: Session, is_numbers: Iterable[str]) -> List[models.ComplianceStatus]:
+    # Recompute the stored compliance status of the given extinguishers from their latest inspection.
+    # Changes (including the dashboard compliance counters) are added to the session; committing is left
+    # to the caller.
+    is_numbers = list(set(is_numbers))
+    if not is_numbers:
+        return []
+
+    # Make pending inspection inserts/updates/deletes visible to the queries below
+    db.flush()
+
+    rows = (
+        db.query(models.FireExtinguisher.is_number, models.FireExtinguisher.admin_id, models.MonthlyActivity)
+        .outerjoin(
+            models.MonthlyActivity,
+            models.MonthlyActivity.id == latest_activity_id(models.FireExtinguisher.is_number),
+        )
+        .filter(models.FireExtinguisher.is_number.in_(is_numbers))
+        .all()
+    )
+    existing = {
+        status.is_number: status
+        for status in db.query(models.ComplianceStatus).filter(models.ComplianceStatus.is_number.in_(is_numbers))
+    }
+
+    now = datetime.utcnow()
+    statuses = []
+    deltas = Counter()
+    for is_number, admin_id, activity in rows:
+        defects, non_compliant = evaluate(activity)
+        status = existing.get(is_number)
+        if status is None:
+            status = models.ComplianceStatus(is_number=is_number)
+            db.add(status)
+            deltas[(admin_id, rollups.COMPLIANCE, rollups.compliance_key(non_compliant))] += 1
+        elif status.non_compliant != non_compliant:
+            deltas[(admin_id, rollups.COMPLIANCE, rollups.compliance_key(status.non_compliant))] -= 1
+            deltas[(admin_id, rollups.COMPLIANCE, rollups.compliance_key(non_compliant))] += 1
+        status.latest_activity_id = activity.id if activity is not None else None
+        status.defects = defects
+        status.non_compliant = non_compliant
+        status.computed_at = now
+        statuses.append(status)
+    rollups.apply_deltas(db, deltas)
+    return statuses
+
+
+def rebuild_compliance(db: Session, batch_size: int = 1000) -> int:
+    # Backfill/recompute the compliance status of every extinguisher, committing once per batch
+    total = 0
+    last_id = 0
+    while True:
+        batch = (
+            db.query(models.FireExtinguisher.id, models.FireExtinguisher.is_number)
+            .filter(models.FireExtinguisher.id > last_id)
+            .order_by(models.FireExtinguisher.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        refresh_compliance(db, [is_number for _, is_number in batch])
+        db.commit()
+        db.expunge_all()
+        total += len(batch)
+        last_id = batch[-1].id
+    return total
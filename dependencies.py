@@ -1,14 +1,28 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
 from fastapi import Depends, HTTPException, status
-from database import SessionLocal
+from sqlalchemy import event
+from database import SessionLocal, AsyncSessionLocal, ReadSessionLocal, AsyncReadSessionLocal
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
-from models import Admin
+from models import Admin, SuperAdmin
 from schemas import TokenData
 from config import settings
+from utils import is_payload_revoked
 
+logger = logging.getLogger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme_super_admin = OAuth2PasswordBearer(tokenUrl="/godmode/login")
+
+# Claim set on super admin tokens so an admin token for the same username is never accepted
+SUPER_ADMIN_SCOPE = "super_admin"
 
 def get_db():
     db = SessionLocal()
@@ -17,6 +31,22 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Read-only handlers: served by the replica when DATABASE_READ_URL is set, otherwise by the primary
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
 # def get_current_admin(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
 #     credentials_exception = HTTPException(
 #         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -40,7 +70,68 @@ def get_db():
 #         raise credentials_exception
 #     return admin
 
-def get_current_admin(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+@dataclass(frozen=True)
+class AdminPrincipal:
+    # Immutable snapshot of an authenticated admin, safe to share between requests. It may be up to
+    # PRINCIPAL_CACHE_TTL_SECONDS old, so authorization checks that depend on current data read the database.
+    id: int
+    username: str
+    license_limit: int
+    is_active: bool
+
+
+class PrincipalCache:
+    # Size-bounded LRU of verified principals keyed by the SHA-256 of the bearer token.
+    # get_current_admin runs in the threadpool, hence the lock.
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token_hash: str) -> Optional[AdminPrincipal]:
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at <= time.monotonic():
+                del self._entries[token_hash]
+                return None
+            self._entries.move_to_end(token_hash)
+            return principal
+
+    def put(self, token_hash: str, principal: AdminPrincipal, token_expires_in: Optional[float] = None):
+        ttl = self.ttl_seconds if token_expires_in is None else min(self.ttl_seconds, token_expires_in)
+        with self._lock:
+            self._entries[token_hash] = (time.monotonic() + ttl, principal)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_admin(self, admin_id: int):
+        with self._lock:
+            for token_hash in [key for key, (_, principal) in self._entries.items() if principal.id == admin_id]:
+                del self._entries[token_hash]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_MAX_SIZE, settings.PRINCIPAL_CACHE_TTL_SECONDS)
+
+
+@event.listens_for(Admin, "after_update")
+@event.listens_for(Admin, "after_delete")
+def invalidate_cached_admin(mapper, connection, target):
+    # Any change to an admin (deactivation, license changes, ...) flushed by this worker drops its cached
+    # principals. Other workers, and changes made with plain SQL or outside the API, are not seen here:
+    # they keep serving the cached principal for at most PRINCIPAL_CACHE_TTL_SECONDS.
+    principal_cache.invalidate_admin(target.id)
+
+
+def get_current_admin(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> AdminPrincipal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -48,19 +139,64 @@ def get_current_admin(db: Session = Depends(get_db), token: str = Depends(oauth2
     )
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        print(f"Decoded payload: {payload}")
         username: str = payload.get("sub")
         license_limit: int = payload.get("lic", 0)
         if username is None:
-            print("Username not found in token payload")
+            logger.info("Username not found in token payload")
             raise credentials_exception
         token_data = TokenData(username=username, lic=license_limit)
     except JWTError as e:
-        print(f"JWTError: {str(e)}")
+        logger.info(f"JWTError: {str(e)}")
+        raise credentials_exception
+    if is_payload_revoked(token, payload):
+        logger.info(f"Revoked token used by: {token_data.username}")
         raise credentials_exception
+
+    # The signature check above is all a cached principal needs, no database round trip
+    token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    principal = principal_cache.get(token_hash)
+    if principal is not None:
+        return principal
+
     admin = db.query(Admin).filter(Admin.username == token_data.username).first()
     if admin is None:
-        print(f"Admin not found for username: {token_data.username}")
+        logger.info(f"Admin not found for username: {token_data.username}")
+        raise credentials_exception
+    if not admin.is_active:
+        logger.info(f"Admin is deactivated: {token_data.username}")
+        raise credentials_exception
+
+    principal = AdminPrincipal(
+        id=admin.id,
+        username=admin.username,
+        license_limit=admin.number_of_licenses,
+        is_active=admin.is_active,
+    )
+    token_expires_in = payload["exp"] - time.time() if "exp" in payload else None
+    principal_cache.put(token_hash, principal, token_expires_in)
+    return principal
+
+
+def get_current_super_admin(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme_super_admin)) -> SuperAdmin:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError as e:
+        logger.info(f"JWTError: {str(e)}")
+        raise credentials_exception
+    username = payload.get("sub")
+    if username is None or payload.get("scope") != SUPER_ADMIN_SCOPE:
+        logger.info("Token without super admin scope used on a godmode route")
+        raise credentials_exception
+    if is_payload_revoked(token, payload):
+        logger.info(f"Revoked token used by super admin: {username}")
+        raise credentials_exception
+    super_admin = db.query(SuperAdmin).filter(SuperAdmin.username == username).first()
+    if super_admin is None:
+        logger.info(f"Super admin not found for username: {username}")
         raise credentials_exception
-    admin.license_limit = token_data.lic  # Attach license limit to the admin object
-    return admin
+    return super_admin
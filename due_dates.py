@@ -0,0 +1,74 @@
+from datetime import date
+from typing import Iterable, Optional, Tuple
+from sqlalchemy.orm import Session
+import models
+import compliance
+
+# Extinguisher dates that make up the next due event, in tie-break order
+DUE_DATE_FIELDS = {
+    "refilling": "due_of_refilling",
+    "hpt": "due_of_hpt",
+    "expiry": "expiry_date",
+}
+
+# Next monthly inspection, taken from the due_date of the latest inspection
+INSPECTION_EVENT = "inspection"
+
+
+def next_due(fire_extinguisher, inspection_due: Optional[date] = None) -> Tuple[Optional[date], Optional[str]]:
+    # Works on a FireExtinguisher instance as well as any object/row exposing the same date attributes
+    candidates = [(getattr(fire_extinguisher, field), event) for event, field in DUE_DATE_FIELDS.items()]
+    candidates.append((inspection_due, INSPECTION_EVENT))
+    candidates = [(due, event) for due, event in candidates if due is not None]
+    if not candidates:
+        return None, None
+    return min(candidates, key=lambda candidate: candidate[0])
+
+
+def apply_next_due(fire_extinguisher, inspection_due: Optional[date] = None):
+    fire_extinguisher.next_due_date, fire_extinguisher.next_due_event = next_due(fire_extinguisher, inspection_due)
+
+
+def refresh_next_due(db: Session, is_numbers: Iterable[str]):
+    # Recompute the next due event of the given extinguishers after their inspections changed.
+    # Changes are added to the session; committing is left to the caller.
+    is_numbers = list(set(is_numbers))
+    if not is_numbers:
+        return
+
+    # Make pending inspection inserts/updates/deletes visible to the query below
+    db.flush()
+
+    rows = (
+        db.query(models.FireExtinguisher, models.MonthlyActivity.due_date)
+        .outerjoin(
+            models.MonthlyActivity,
+            models.MonthlyActivity.id == compliance.latest_activity_id(models.FireExtinguisher.is_number),
+        )
+        .filter(models.FireExtinguisher.is_number.in_(is_numbers))
+        .all()
+    )
+    for fire_extinguisher, inspection_due in rows:
+        apply_next_due(fire_extinguisher, inspection_due)
+
+
+def rebuild_next_due(db: Session, batch_size: int = 1000) -> int:
+    # Backfill next_due_date/next_due_event of every extinguisher, committing once per batch
+    total = 0
+    last_id = 0
+    while True:
+        batch = (
+            db.query(models.FireExtinguisher.id, models.FireExtinguisher.is_number)
+            .filter(models.FireExtinguisher.id > last_id)
+            .order_by(models.FireExtinguisher.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        refresh_next_due(db, [is_number for _, is_number in batch])
+        db.commit()
+        db.expunge_all()
+        total += len(batch)
+        last_id = batch[-1].id
+    return total
@@ -0,0 +1,193 @@
+import csv
+import io
+import json
+from datetime import date
+from typing import Any, Dict, Iterator, Optional
+
+from sqlalchemy import select
+
+import models
+from database import ReadSessionLocal
+
+# Rows fetched per round trip from the server-side cursor
+BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    models.MonthlyActivity.id,
+    models.MonthlyActivity.is_number,
+    models.FireExtinguisher.admin_id,
+    models.FireExtinguisher.type_of_extinguisher,
+    models.FireExtinguisher.location,
+    models.MonthlyActivity.inspection_date,
+    models.MonthlyActivity.due_date,
+    models.MonthlyActivity.inspectors_name,
+    models.MonthlyActivity.capacity_uom,
+    models.MonthlyActivity.weight,
+    models.MonthlyActivity.pressure,
+    models.MonthlyActivity.cylinder_nozzle,
+    models.MonthlyActivity.operating_lever,
+    models.MonthlyActivity.safety_pin,
+    models.MonthlyActivity.pressure_gauge,
+    models.MonthlyActivity.paint_peeled_off,
+    models.MonthlyActivity.presence_of_rust,
+    models.MonthlyActivity.damaged_cylinder,
+    models.MonthlyActivity.dent_on_body,
+    models.MonthlyActivity.complaints,
+    models.MonthlyActivity.additional_info,
+)
+
+FIELD_NAMES = [column.key for column in EXPORT_COLUMNS]
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_query(
+    admin_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    type_of_extinguisher: Optional[str] = None,
+):
+    # Only scalar columns are selected, images are never touched
+    query = select(*EXPORT_COLUMNS).join(
+        models.FireExtinguisher, models.FireExtinguisher.is_number == models.MonthlyActivity.is_number
+    )
+    if admin_id is not None:
+        query = query.where(models.FireExtinguisher.admin_id == admin_id)
+    if start_date:
+        query = query.where(models.MonthlyActivity.inspection_date >= start_date)
+    if end_date:
+        query = query.where(models.MonthlyActivity.inspection_date <= end_date)
+    if type_of_extinguisher:
+        query = query.where(models.FireExtinguisher.type_of_extinguisher == type_of_extinguisher)
+    return query.order_by(models.MonthlyActivity.id)
+
+
+def iter_row_batches(query) -> Iterator[list]:
+    # Runs on its own session because the response body is produced after the request handler returned.
+    # yield_per keeps a server-side cursor open on PostgreSQL, so memory stays flat however many rows match.
+    db = ReadSessionLocal()
+    try:
+        result = db.execute(query.execution_options(yield_per=BATCH_SIZE))
+        for partition in result.partitions():
+            yield partition
+    finally:
+        db.close()
+
+
+def plain_row(row) -> Dict[str, Any]:
+    values = row._asdict()
+    values["inspection_date"] = row.inspection_date.isoformat()
+    values["due_date"] = row.due_date.isoformat()
+    return values
+
+
+def stream_csv(query) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELD_NAMES)
+    writer.writeheader()
+    for rows in iter_row_batches(query):
+        for row in rows:
+            values = plain_row(row)
+            values["additional_info"] = json.dumps(values["additional_info"] or {})
+            writer.writerow(values)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(query) -> Iterator[str]:
+    for rows in iter_row_batches(query):
+        yield "".join(json.dumps(plain_row(row)) + "\n" for row in rows)
+
+
+class ChunkSink(io.RawIOBase):
+    # Write-only file that hands back whatever was written since the last drain
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("is_number", pa.string()),
+        ("admin_id", pa.int64()),
+        ("type_of_extinguisher", pa.string()),
+        ("location", pa.string()),
+        ("inspection_date", pa.date32()),
+        ("due_date", pa.date32()),
+        ("inspectors_name", pa.string()),
+        ("capacity_uom", pa.string()),
+        ("weight", pa.string()),
+        ("pressure", pa.string()),
+        ("cylinder_nozzle", pa.bool_()),
+        ("operating_lever", pa.bool_()),
+        ("safety_pin", pa.bool_()),
+        ("pressure_gauge", pa.bool_()),
+        ("paint_peeled_off", pa.bool_()),
+        ("presence_of_rust", pa.bool_()),
+        ("damaged_cylinder", pa.bool_()),
+        ("dent_on_body", pa.bool_()),
+        ("complaints", pa.string()),
+        ("additional_info", pa.string()),
+    ])
+
+
+def stream_parquet(query) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Every batch becomes one row group, flushed to the client as soon as it is written
+    schema = parquet_schema()
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in iter_row_batches(query):
+            columns = {name: [] for name in FIELD_NAMES}
+            for row in rows:
+                for name, value in zip(FIELD_NAMES, row):
+                    columns[name].append(value)
+            columns["additional_info"] = [json.dumps(value or {}) for value in columns["additional_info"]]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+STREAMERS = {
+    "csv": stream_csv,
+    "ndjson": stream_ndjson,
+    "parquet": stream_parquet,
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
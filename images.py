@@ -0,0 +1,72 @@
+import io
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, List
+
+from PIL import Image, ImageOps
+
+import models
+import storage
+from config import settings
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels of every generated variant
+VARIANTS = {
+    "thumbnail": 256,
+    "medium": 1024,
+}
+
+# Pillow releases the GIL while decoding and resizing, so a small thread pool keeps this off the event loop
+executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS, thread_name_prefix="image-variants")
+
+
+def schedule_variants(image_ids: Iterable[int]) -> List[Future]:
+    return [executor.submit(generate_variants, image_id) for image_id in image_ids]
+
+
+def render_variant(original: Image.Image, max_side: int) -> bytes:
+    variant = original.copy()
+    variant.thumbnail((max_side, max_side))
+    if variant.mode not in ("RGB", "L"):
+        variant = variant.convert("RGB")
+    buffer = io.BytesIO()
+    # Saved without the exif argument, so no EXIF metadata (GPS, device) is carried over
+    variant.save(buffer, "JPEG", quality=80, optimize=True)
+    return buffer.getvalue()
+
+
+def generate_variants(image_id: int):
+    db = SessionLocal()
+    try:
+        image = db.get(models.MonthlyActivityImage, image_id)
+        if image is None or image.sha256 is None:
+            return
+
+        blob_store = storage.get_blob_store()
+        existing = {variant.variant for variant in image.variants}
+        with blob_store.open(image.sha256) as blob, Image.open(blob) as original:
+            # Apply the EXIF orientation before the metadata is dropped
+            original = ImageOps.exif_transpose(original)
+            for name, max_side in VARIANTS.items():
+                if name in existing:
+                    continue
+                data = render_variant(original, max_side)
+                stored = blob_store.put_bytes(data)
+                _, width, height = storage.describe_image(blob_store, stored.sha256)
+                db.add(models.MonthlyActivityImageVariant(
+                    image_id=image.id,
+                    variant=name,
+                    sha256=stored.sha256,
+                    size=stored.size,
+                    mime_type="image/jpeg",
+                    width=width,
+                    height=height,
+                ))
+        db.commit()
+    except Exception:
+        logger.exception(f"Failed to generate variants for image {image_id}")
+        db.rollback()
+    finally:
+        db.close()
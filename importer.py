@@ -0,0 +1,164 @@
+import csv
+import io
+import logging
+from collections import Counter
+from datetime import date, datetime
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+import licenses
+import compliance
+import due_dates
+import measurements
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Rows validated and inserted per transaction
+CHUNK_SIZE = 1000
+
+
+def iter_csv_rows(file: BinaryIO) -> Iterator[Dict]:
+    # utf-8-sig drops the BOM Excel adds when saving as CSV
+    yield from csv.DictReader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+
+
+def iter_xlsx_rows(file: BinaryIO) -> Iterator[Dict]:
+    from openpyxl import load_workbook
+
+    # read_only streams the sheet instead of building the whole workbook in memory
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else "" for cell in next(rows, ())]
+        for values in rows:
+            yield dict(zip(header, [cell_to_text(value) for value in values]))
+    finally:
+        workbook.close()
+
+
+def cell_to_text(value):
+    # Spreadsheet cells come back typed; the schema expects text for everything but dates
+    if isinstance(value, datetime):
+        return value.date()
+    if value is None or isinstance(value, date):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def validation_messages(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()]
+
+
+class FireExtinguisherImport:
+    def __init__(self, db: Session, admin_id: int):
+        self.db = db
+        self.admin_id = admin_id
+        self.inserted = 0
+        self.errors: List[schemas.ImportRowError] = []
+        self.seen_is_numbers = set()
+
+    def fail(self, row_number: int, *messages: str):
+        self.errors.append(schemas.ImportRowError(row=row_number, errors=list(messages)))
+
+    def run(self, rows: Iterator[Dict]) -> schemas.FireExtinguisherImportResponse:
+        chunk: List[Tuple[int, Dict]] = []
+        # Row 1 is the header, so data rows are numbered as in the spreadsheet
+        for row_number, row in enumerate(rows, start=2):
+            if not any(value not in (None, "") for value in row.values()):
+                continue
+            try:
+                item = schemas.FireExtinguisherCreate.model_validate(row)
+            except ValidationError as error:
+                self.fail(row_number, *validation_messages(error))
+                continue
+            values = item.model_dump()
+            values["next_due_date"], values["next_due_event"] = due_dates.next_due(item)
+            values.update(measurements.fire_extinguisher_measurements(item))
+            chunk.append((row_number, values))
+            if len(chunk) >= CHUNK_SIZE:
+                self.insert_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.insert_chunk(chunk)
+
+        return schemas.FireExtinguisherImportResponse(
+            inserted=self.inserted,
+            failed=len(self.errors),
+            errors=sorted(self.errors, key=lambda error: error.row),
+        )
+
+    def insert_chunk(self, chunk: List[Tuple[int, Dict]]):
+        # IS numbers are derived in bulk, then checked against the file and the database with one IN query
+        records = []
+        for row_number, values in chunk:
+            values["is_number"] = models.build_is_number(values["type_of_extinguisher"], values["cylinder_number"])
+            values["admin_id"] = self.admin_id
+            records.append((row_number, values))
+
+        existing = {
+            is_number for (is_number,) in self.db.query(models.FireExtinguisher.is_number)
+            .filter(models.FireExtinguisher.is_number.in_([values["is_number"] for _, values in records]))
+        }
+        accepted = []
+        for row_number, values in records:
+            if values["is_number"] in existing or values["is_number"] in self.seen_is_numbers:
+                self.fail(row_number, f"Duplicate IS number {values['is_number']}")
+                continue
+            self.seen_is_numbers.add(values["is_number"])
+            accepted.append((row_number, values))
+        if not accepted:
+            return
+
+        # Reserve all licenses of the chunk in one statement, or as many as remain
+        if not licenses.reserve_licenses(self.db, self.admin_id, len(accepted)):
+            available = licenses.available_licenses(self.db, self.admin_id)
+            if not available or not licenses.reserve_licenses(self.db, self.admin_id, available):
+                available = 0
+            for row_number, _ in accepted[available:]:
+                self.fail(row_number, "License limit reached")
+            accepted = accepted[:available]
+            if not accepted:
+                self.db.rollback()
+                return
+
+        rows = [values for _, values in accepted]
+        try:
+            # executemany is sent as multi-row INSERT ... VALUES batches by SQLAlchemy
+            self.db.execute(insert(models.FireExtinguisher), rows)
+            statuses = [compliance.initial_status(values["is_number"]) for values in rows]
+            self.db.execute(
+                insert(models.ComplianceStatus),
+                [
+                    {
+                        "is_number": status.is_number,
+                        "latest_activity_id": status.latest_activity_id,
+                        "defects": status.defects,
+                        "non_compliant": status.non_compliant,
+                        "computed_at": status.computed_at,
+                    }
+                    for status in statuses
+                ],
+            )
+            deltas = Counter()
+            for values in rows:
+                deltas.update(rollups.registered_deltas(self.admin_id, values))
+            rollups.apply_deltas(self.db, deltas)
+            self.db.commit()
+        except IntegrityError:
+            # A concurrent registration took one of the IS numbers; nothing of this chunk was kept
+            self.db.rollback()
+            logger.info(f"Import chunk for admin {self.admin_id} conflicted with existing rows")
+            for row_number, _ in accepted:
+                self.fail(row_number, "Conflicts with an existing fire extinguisher")
+            return
+        self.inserted += len(accepted)
+
@@ -0,0 +1,43 @@
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+import models
+
+
+def reserve_licenses(db: Session, admin_id: int, count: int = 1) -> bool:
+    # Conditional UPDATE in the caller's transaction: it only succeeds while enough licenses remain, and the
+    # row lock it takes serializes concurrent registrations of the same admin until commit/rollback
+    result = db.execute(
+        update(models.Admin)
+        .where(
+            models.Admin.id == admin_id,
+            models.Admin.licenses_used + count <= models.Admin.number_of_licenses,
+        )
+        .values(licenses_used=models.Admin.licenses_used + count)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def license_limit(db: Session, admin_id: int) -> int:
+    # Current limit from the database; the cached AdminPrincipal may predate a license change
+    return db.query(models.Admin.number_of_licenses).filter(models.Admin.id == admin_id).scalar() or 0
+
+
+def available_licenses(db: Session, admin_id: int) -> int:
+    remaining = (
+        db.query(models.Admin.number_of_licenses - models.Admin.licenses_used)
+        .filter(models.Admin.id == admin_id)
+        .scalar()
+    )
+    return max(remaining or 0, 0)
+
+
+def recount_licenses(db: Session):
+    # Backfill licenses_used from the registered fire extinguishers
+    registered = (
+        select(func.count(models.FireExtinguisher.id))
+        .where(models.FireExtinguisher.admin_id == models.Admin.id)
+        .scalar_subquery()
+    )
+    db.execute(update(models.Admin).values(licenses_used=registered).execution_options(synchronize_session=False))
+    db.commit()
@@ -1,11 +1,32 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
 import models
+import metrics
+import reminders
+import slow_queries
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-from database import engine
+from config import settings
+from database import ENGINES, engine
 from routers import users, admins, fire_extinguishers, monthly_activity, super_admin
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Opt-in: with several API workers prefer a single `python manage.py run-reminders` process instead
+    reminder_task = None
+    if settings.REMINDERS_ENABLED:
+        reminder_task = asyncio.create_task(reminders.reminder_loop(settings.REMINDER_INTERVAL_SECONDS))
+    yield
+    if reminder_task is not None:
+        # Waits for a run in progress to commit or roll back and close its session
+        reminder_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await reminder_task
+
+
+app = FastAPI(lifespan=lifespan)
 
 # List of allowed origins (you can add more origins as needed)
 origins = [
@@ -30,6 +51,9 @@ app.include_router(fire_extinguishers.router, prefix="/fireextinguishers", tags=
 app.include_router(monthly_activity.router, prefix="/monthlyactivity", tags=["Monthlyactivity"])
 app.include_router(admins.router, prefix="/token", tags=["token"], include_in_schema=False)
 
+metrics.install(app, *ENGINES)
+slow_queries.install(*ENGINES)
+
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
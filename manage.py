@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import logging
+import os
+
+# Maintenance commands legitimately run longer than the API's statement timeout
+os.environ.setdefault("DB_STATEMENT_TIMEOUT_MS", "0")
+
+import models
+import migrations
+import compliance
+import due_dates
+import licenses
+import measurements
+import rollups
+import reminders
+import storage
+from config import settings
+from database import SessionLocal, engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def rebuild_compliance(args):
+    db = SessionLocal()
+    try:
+        total = compliance.rebuild_compliance(db, batch_size=args.batch_size)
+        logger.info(f"Rebuilt compliance status for {total} fire extinguishers")
+    finally:
+        db.close()
+
+
+def migrate_blobs(args):
+    db = SessionLocal()
+    try:
+        total = storage.migrate_database_blobs(db, storage.get_blob_store(), batch_size=args.batch_size)
+        logger.info(f"Moved {total} images out of the database")
+    finally:
+        db.close()
+
+
+def strip_image_metadata(args):
+    db = SessionLocal()
+    try:
+        total = storage.strip_stored_metadata(db, storage.get_blob_store(), batch_size=args.batch_size)
+        logger.info(f"Stripped metadata from {total} images")
+    finally:
+        db.close()
+
+
+def recount_licenses(args):
+    db = SessionLocal()
+    try:
+        licenses.recount_licenses(db)
+        logger.info("Recounted used licenses of every admin")
+    finally:
+        db.close()
+
+
+def backfill_next_due(args):
+    db = SessionLocal()
+    try:
+        total = due_dates.rebuild_next_due(db, batch_size=args.batch_size)
+        logger.info(f"Recomputed the next due event of {total} fire extinguishers")
+    finally:
+        db.close()
+
+
+def backfill_measurements(args):
+    db = SessionLocal()
+    try:
+        total = measurements.backfill_measurements(db, batch_size=args.batch_size)
+        logger.info(f"Parsed numeric measurements of {total} rows")
+    finally:
+        db.close()
+
+
+def rebuild_rollups(args):
+    db = SessionLocal()
+    try:
+        total = rollups.rebuild_rollups(db)
+        logger.info(f"Rebuilt {total} dashboard counters")
+    finally:
+        db.close()
+
+
+def add_columns(args):
+    # Must run first when upgrading an existing database, the backfill commands fill these columns
+    with engine.begin() as connection:
+        migrations.upgrade_schema(connection)
+    logger.info("Database schema is up to date")
+
+
+def create_indexes(args):
+    with engine.begin() as connection:
+        migrations.create_missing_indexes(connection)
+    logger.info("Created missing indexes")
+
+
+def run_reminders(args):
+    # Standalone reminder worker, an alternative to REMINDERS_ENABLED in the API process
+    if args.once:
+        reminders.run_once()
+    else:
+        asyncio.run(reminders.reminder_loop(args.interval))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IntelliShield maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_columns_parser = subparsers.add_parser(
+        "add-columns",
+        help="Add new columns and indexes to existing tables; run before the backfill commands when upgrading",
+    )
+    add_columns_parser.set_defaults(func=add_columns)
+
+    rebuild_compliance_parser = subparsers.add_parser(
+        "rebuild-compliance", help="Backfill the compliance status of every fire extinguisher"
+    )
+    rebuild_compliance_parser.add_argument("--batch-size", type=int, default=1000)
+    rebuild_compliance_parser.set_defaults(func=rebuild_compliance)
+
+    migrate_blobs_parser = subparsers.add_parser(
+        "migrate-blobs", help="Move inspection photos stored in the database into the blob store"
+    )
+    migrate_blobs_parser.add_argument("--batch-size", type=int, default=100)
+    migrate_blobs_parser.set_defaults(func=migrate_blobs)
+
+    strip_image_metadata_parser = subparsers.add_parser(
+        "strip-image-metadata", help="Remove EXIF (GPS, camera) metadata from photos stored before uploads were stripped"
+    )
+    strip_image_metadata_parser.add_argument("--batch-size", type=int, default=100)
+    strip_image_metadata_parser.set_defaults(func=strip_image_metadata)
+
+    recount_licenses_parser = subparsers.add_parser(
+        "recount-licenses", help="Backfill the used license counter of every admin"
+    )
+    recount_licenses_parser.set_defaults(func=recount_licenses)
+
+    backfill_next_due_parser = subparsers.add_parser(
+        "backfill-next-due", help="Recompute the next due date and event of every fire extinguisher"
+    )
+    backfill_next_due_parser.add_argument("--batch-size", type=int, default=1000)
+    backfill_next_due_parser.set_defaults(func=backfill_next_due)
+
+    backfill_measurements_parser = subparsers.add_parser(
+        "backfill-measurements", help="Fill the numeric weight, capacity and pressure columns from the text fields"
+    )
+    backfill_measurements_parser.add_argument("--batch-size", type=int, default=1000)
+    backfill_measurements_parser.set_defaults(func=backfill_measurements)
+
+    rebuild_rollups_parser = subparsers.add_parser(
+        "rebuild-rollups", help="Recompute the dashboard counters of every admin"
+    )
+    rebuild_rollups_parser.set_defaults(func=rebuild_rollups)
+
+    create_indexes_parser = subparsers.add_parser(
+        "create-indexes", help="Create indexes added to existing tables, including the search trigram indexes"
+    )
+    create_indexes_parser.set_defaults(func=create_indexes)
+
+    run_reminders_parser = subparsers.add_parser(
+        "run-reminders", help="Send due and overdue equipment reminders"
+    )
+    run_reminders_parser.add_argument("--once", action="store_true", help="Run a single pass and exit")
+    run_reminders_parser.add_argument("--interval", type=int, default=settings.REMINDER_INTERVAL_SECONDS)
+    run_reminders_parser.set_defaults(func=run_reminders)
+
+    args = parser.parse_args()
+
+    # Make sure newly added tables exist before running any command
+    models.Base.metadata.create_all(bind=engine)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
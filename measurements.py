@@ -0,0 +1,98 @@
+import re
+from typing import Optional
+from sqlalchemy.orm import Session
+import models
+
+# Free-text readings look like "4.5", "4.5 kg", "4,5KG", "12 bar", "175 psi"
+NUMBER_PATTERN = re.compile(r"(-?\d+(?:[.,]\d+)?)\s*([a-zA-Z/²0-9]*)")
+
+# Conversion factors to kilograms
+WEIGHT_UNITS = {
+    "kg": 1.0,
+    "kgs": 1.0,
+    "g": 0.001,
+    "gm": 0.001,
+    "lb": 0.45359237,
+    "lbs": 0.45359237,
+}
+
+# Conversion factors to bar; kg/cm2 is the unit on older gauges
+PRESSURE_UNITS = {
+    "bar": 1.0,
+    "psi": 0.0689475729,
+    "kpa": 0.01,
+    "mpa": 10.0,
+    "kg/cm2": 0.980665,
+    "kg/cm²": 0.980665,
+    "kgf/cm2": 0.980665,
+}
+
+
+def parse_quantity(text, units: dict, default_unit: Optional[str]) -> Optional[float]:
+    # Returns the value converted with `units`, or None when the text has no number or an unknown unit
+    if text is None:
+        return None
+    match = NUMBER_PATTERN.search(str(text))
+    if match is None:
+        return None
+    value = float(match.group(1).replace(",", "."))
+    unit = (match.group(2) or default_unit or "").lower()
+    factor = units.get(unit)
+    if factor is None:
+        return None
+    return round(value * factor, 4)
+
+
+def parse_weight_kg(text, uom: Optional[str] = None) -> Optional[float]:
+    return parse_quantity(text, WEIGHT_UNITS, uom or "kg")
+
+
+def parse_pressure_bar(text) -> Optional[float]:
+    return parse_quantity(text, PRESSURE_UNITS, "bar")
+
+
+def fire_extinguisher_measurements(source) -> dict:
+    # Works on a FireExtinguisher instance as well as the create schema
+    return {
+        "net_weight_kg": parse_weight_kg(source.net_weight, source.uom),
+        "capacity_kg": parse_weight_kg(source.capacity, source.uom),
+    }
+
+
+def activity_measurements(source) -> dict:
+    # Works on a MonthlyActivity instance as well as the create schema
+    return {
+        "weight_kg": parse_weight_kg(source.weight, source.capacity_uom),
+        "pressure_bar": parse_pressure_bar(source.pressure),
+    }
+
+
+def apply_fire_extinguisher_measurements(fire_extinguisher: models.FireExtinguisher):
+    for name, value in fire_extinguisher_measurements(fire_extinguisher).items():
+        setattr(fire_extinguisher, name, value)
+
+
+def apply_activity_measurements(activity: models.MonthlyActivity):
+    for name, value in activity_measurements(activity).items():
+        setattr(activity, name, value)
+
+
+def backfill_measurements(db: Session, batch_size: int = 1000) -> int:
+    # Fill the numeric columns from the free-text ones for every existing row, committing once per batch
+    total = 0
+    for model, apply in (
+        (models.FireExtinguisher, apply_fire_extinguisher_measurements),
+        (models.MonthlyActivity, apply_activity_measurements),
+    ):
+        last_id = 0
+        while True:
+            batch = db.query(model).filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not batch:
+                break
+            for row in batch:
+                apply(row)
+            last_id = batch[-1].id
+            db.commit()
+            db.expunge_all()
+            total += len(batch)
+    return total
@@ -0,0 +1,208 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+
+from config import settings
+
+# Upper bounds in seconds; the implicit +Inf bucket catches the rest
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self, label_names: Tuple[str, ...]):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                yield f"{self.name}{format_labels(label_names, labels)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self, label_names: Tuple[str, ...]):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for labels, (bucket_counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip((*self.buckets, "+Inf"), bucket_counts):
+                    cumulative += bucket_count
+                    le = bound if bound == "+Inf" else format_value(bound)
+                    yield f"{self.name}_bucket{format_labels((*label_names, 'le'), (*labels, le))} {cumulative}"
+                yield f"{self.name}_sum{format_labels(label_names, labels)} {format_value(total)}"
+                yield f"{self.name}_count{format_labels(label_names, labels)} {count}"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+ROUTE_LABELS = ("method", "route")
+
+requests_total = Counter("http_requests_total", "HTTP requests by route and status code")
+request_duration = Histogram("http_request_duration_seconds", "HTTP request latency", LATENCY_BUCKETS)
+requests_in_progress = Gauge("http_requests_in_progress", "HTTP requests currently being served")
+request_queries = Histogram("db_queries_per_request", "Database queries issued per HTTP request", QUERY_COUNT_BUCKETS)
+request_db_time = Histogram("db_time_per_request_seconds", "Time spent in database queries per HTTP request", LATENCY_BUCKETS)
+queries_total = Counter("db_queries_total", "Database queries issued, inside and outside requests")
+
+# (metric, label names) in /metrics output order
+REGISTRY = [
+    (requests_total, (*ROUTE_LABELS, "status")),
+    (request_duration, ROUTE_LABELS),
+    (requests_in_progress, ()),
+    (request_queries, ROUTE_LABELS),
+    (request_db_time, ROUTE_LABELS),
+    (queries_total, ()),
+]
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Set by the middleware for the duration of a request. Sync endpoints and streaming bodies run in the
+# threadpool with a copy of the context, which still points at the same RequestStats object.
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+# The start time lives on the execution context, which belongs to a single statement: a statement that
+# raises never reaches after_cursor_execute and simply drops its context, nothing is left on the connection
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_started_at = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, "metrics_started_at", None)
+    if started_at is None:
+        return
+    elapsed = time.perf_counter() - started_at
+    queries_total.inc()
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+def instrument_engine(engine):
+    # Accepts sync engines and the sync_engine of an AsyncEngine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware: no request/response objects are built and streaming bodies pass through untouched
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        requests_in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_progress.dec()
+            current_request.reset(token)
+            # The route template keeps label cardinality bounded, /fireextinguishers/{is_number} not every IS number
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", "unmatched"))
+            requests_total.inc((*labels, str(status_code)))
+            request_duration.observe(labels, elapsed)
+            request_queries.observe(labels, stats.queries)
+            request_db_time.observe(labels, stats.db_time)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric, label_names in REGISTRY:
+        lines.extend(metric.render(label_names))
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_endpoint():
+    return PlainTextResponse(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def install(app: FastAPI, *engines):
+    # Nothing is hooked when METRICS_ENABLED is off, so disabled metrics cost nothing per request or query
+    if not settings.METRICS_ENABLED:
+        return
+    for engine in engines:
+        instrument_engine(engine)
+    app.add_middleware(MetricsMiddleware)
+    app.add_api_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
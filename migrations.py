@@ -0,0 +1,123 @@
+import logging
+import re
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# create_all only creates missing tables, it never alters existing ones. Columns added to tables that
+# already existed at deployment are listed here and added by `python manage.py add-columns`, which has
+# to run before the backfill commands that fill them.
+ADDED_COLUMNS = [
+    # Blob store metadata of inspection photos (migrate-blobs)
+    models.MonthlyActivityImage.__table__.c.sha256,
+    models.MonthlyActivityImage.__table__.c.size,
+    models.MonthlyActivityImage.__table__.c.mime_type,
+    models.MonthlyActivityImage.__table__.c.width,
+    models.MonthlyActivityImage.__table__.c.height,
+    # Used license counter of each admin (recount-licenses)
+    models.Admin.__table__.c.licenses_used,
+    # Next due date and event of each extinguisher (backfill-next-due), indexed by create_missing_indexes
+    models.FireExtinguisher.__table__.c.next_due_date,
+    models.FireExtinguisher.__table__.c.next_due_event,
+    # Numeric measurements (backfill-measurements)
+    models.FireExtinguisher.__table__.c.net_weight_kg,
+    models.FireExtinguisher.__table__.c.capacity_kg,
+    models.MonthlyActivity.__table__.c.weight_kg,
+    models.MonthlyActivity.__table__.c.pressure_bar,
+    # Batch sync idempotency key, made unique by ix_monthlyactivity_idempotency_key
+    models.MonthlyActivity.__table__.c.idempotency_key,
+    # Incremental revocation refresh, indexed by create_missing_indexes (rows without it come with full reloads)
+    models.RevokedToken.__table__.c.revoked_at,
+]
+
+# Columns that were NOT NULL at deployment and are nullable now
+RELAXED_COLUMNS = [
+    # New photos live in the blob store, only legacy rows keep inline bytes
+    models.MonthlyActivityImage.__table__.c.image_data,
+]
+
+
+def add_missing_columns(connection: Connection) -> List[str]:
+    inspector = inspect(connection)
+    compiler = connection.dialect.ddl_compiler(connection.dialect, None)
+    added = []
+    for column in ADDED_COLUMNS:
+        table = column.table
+        if not inspector.has_table(table.name):
+            continue  # created complete by create_all
+        existing = {info["name"] for info in inspector.get_columns(table.name)}
+        if column.name in existing:
+            continue
+        connection.execute(text(f"ALTER TABLE {compiler.preparer.format_table(table)} ADD COLUMN {compiler.get_column_specification(column)}"))
+        added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def sqlite_drop_not_null(connection: Connection, table_name: str, column_name: str):
+    # SQLite cannot alter a column: rebuild the table from its own CREATE statement without the NOT NULL,
+    # following https://www.sqlite.org/lang_altertable.html#otheralter (create new, copy, drop old, rename)
+    create_sql = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).scalar()
+    new_create_sql = re.sub(rf"(\b{column_name}\b[^,]*?)\s+NOT NULL", r"\1", create_sql, count=1, flags=re.IGNORECASE)
+    temporary_name = f"{table_name}__new"
+    new_create_sql = re.sub(rf'^CREATE TABLE\s+"?{table_name}"?', f'CREATE TABLE "{temporary_name}"', new_create_sql)
+    index_sql = [
+        sql for (sql,) in connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table_name,)
+        )
+    ]
+    columns = ", ".join(f'"{row[1]}"' for row in connection.exec_driver_sql(f'PRAGMA table_info("{table_name}")'))
+
+    # pysqlite does not wrap DDL in the transaction, clear what an interrupted run may have left behind
+    connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{temporary_name}"')
+    connection.exec_driver_sql(new_create_sql)
+    connection.exec_driver_sql(f'INSERT INTO "{temporary_name}" ({columns}) SELECT {columns} FROM "{table_name}"')
+    connection.exec_driver_sql(f'DROP TABLE "{table_name}"')
+    connection.exec_driver_sql(f'ALTER TABLE "{temporary_name}" RENAME TO "{table_name}"')
+    for sql in index_sql:
+        connection.exec_driver_sql(sql)
+
+
+def relax_not_null_columns(connection: Connection) -> List[str]:
+    inspector = inspect(connection)
+    relaxed = []
+    for column in RELAXED_COLUMNS:
+        table = column.table
+        if not inspector.has_table(table.name):
+            continue
+        info = next(info for info in inspector.get_columns(table.name) if info["name"] == column.name)
+        if info["nullable"]:
+            continue
+        if connection.dialect.name == "sqlite":
+            sqlite_drop_not_null(connection, table.name, column.name)
+        else:
+            preparer = connection.dialect.identifier_preparer
+            connection.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} ALTER COLUMN {preparer.format_column(column)} DROP NOT NULL"
+            ))
+        relaxed.append(f"{table.name}.{column.name}")
+    return relaxed
+
+
+def create_missing_indexes(connection: Connection):
+    # create_all only adds indexes together with new tables; this creates the ones missing on existing tables
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def upgrade_schema(connection: Connection):
+    for name in add_missing_columns(connection):
+        logger.info(f"Added column {name}")
+    for name in relax_not_null_columns(connection):
+        logger.info(f"Dropped NOT NULL on {name}")
+    # Indexes on the new columns can only be created once the columns exist
+    create_missing_indexes(connection)
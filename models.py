@@ -1,7 +1,8 @@
-from sqlalchemy import Boolean, Column, Integer, String, Date, ForeignKey, LargeBinary, JSON
-from sqlalchemy.orm import relationship
+from sqlalchemy import DDL, Boolean, Column, Float, Integer, String, Date, DateTime, ForeignKey, LargeBinary, JSON, Index, UniqueConstraint
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, deferred
 from database import Base
-import bcrypt
+from passwords import hash_password_sync, verify_password_sync
 from cryptography.fernet import Fernet
 import os
 
@@ -18,10 +19,10 @@ class SuperAdmin(Base):
     hashed_password = Column(String)
 
     def set_password(self, password: str):
-        self.hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.hashed_password = hash_password_sync(password)
 
     def check_password(self, password: str) -> bool:
-        return bcrypt.checkpw(password.encode('utf-8'), self.hashed_password.encode('utf-8'))
+        return verify_password_sync(password, self.hashed_password)
 
 
 class Admin(Base):
@@ -37,14 +38,16 @@ class Admin(Base):
     updated_at = Column(Date)
     hashed_password = Column(String)
     number_of_licenses = Column(Integer, default=0)
+    # Fire extinguishers registered against number_of_licenses, maintained by licenses.reserve_licenses
+    licenses_used = Column(Integer, nullable=False, default=0, server_default="0")
     
     fire_extinguishers = relationship("FireExtinguisher", back_populates="admin")
 
     def set_password(self, password: str):
-        self.hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.hashed_password = hash_password_sync(password)
 
     def check_password(self, password: str) -> bool:
-        return bcrypt.checkpw(password.encode('utf-8'), self.hashed_password.encode('utf-8'))
+        return verify_password_sync(password, self.hashed_password)
 
 
 class User(Base):
@@ -62,10 +65,10 @@ class User(Base):
     updated_at = Column(Date, nullable=True)
     
     def set_password(self, password: str):
-        self.hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.hashed_password = hash_password_sync(password)
 
     def check_password(self, password: str) -> bool:
-        return bcrypt.checkpw(password.encode('utf-8'), self.hashed_password.encode('utf-8'))
+        return verify_password_sync(password, self.hashed_password)
     
     def encrypt_aadhaar(self, aadhaar: str):
         encrypted_aadhaar = cipher_suite.encrypt(aadhaar.encode('utf-8'))
@@ -99,6 +102,9 @@ class FireExtinguisher(Base):
     uom = Column(String(5), nullable=False)
     net_weight = Column(String(20), nullable=False)
     capacity = Column(String(20), nullable=False)
+    # net_weight/capacity parsed and converted to kg by measurements.py, for SQL analytics
+    net_weight_kg = Column(Float, nullable=True)
+    capacity_kg = Column(Float, nullable=True)
     date_of_refilling = Column(Date, nullable=False)
     due_of_refilling = Column(Date, nullable=False)
     date_of_hpt = Column(Date, nullable=False)
@@ -106,13 +112,48 @@ class FireExtinguisher(Base):
     manufacturing_date = Column(Date, nullable=False)
     expiry_date = Column(Date, nullable=False)
     admin_id = Column(Integer, ForeignKey("admin.id"))
+    # Earliest of refilling, HPT, expiry and next inspection due dates, maintained by due_dates.py.
+    # Only a prefilter for upcoming work, which reads every due date column itself.
+    next_due_date = Column(Date, nullable=True)
+    next_due_event = Column(String(20), nullable=True)
     admin = relationship("Admin", back_populates="fire_extinguishers")
     
     monthly_activities = relationship("MonthlyActivity", back_populates="fire_extinguisher")
 
+    __table_args__ = (
+        # Upcoming-work prefilter: per admin, optionally narrowed to a location or service provider
+        Index("ix_fireextinguisher_admin_next_due", "admin_id", "next_due_date", "id"),
+        Index("ix_fireextinguisher_admin_location_next_due", "admin_id", "location", "next_due_date", "id"),
+        Index("ix_fireextinguisher_admin_provider_next_due", "admin_id", "service_provider", "next_due_date", "id"),
+        # Date-window scans of the reminder job
+        Index("ix_fireextinguisher_due_of_refilling", "due_of_refilling", "id"),
+        Index("ix_fireextinguisher_due_of_hpt", "due_of_hpt", "id"),
+        Index("ix_fireextinguisher_expiry_date", "expiry_date", "id"),
+        # Trigram indexes serving the ILIKE substring/prefix matches of the search endpoint (PostgreSQL only)
+        *[
+            Index(
+                f"ix_fireextinguisher_{column}_trgm", column,
+                postgresql_using="gin", postgresql_ops={column: "gin_trgm_ops"},
+            ).ddl_if(dialect="postgresql")
+            for column in ("is_number", "location", "location_tag_number", "cylinder_number", "service_provider")
+        ],
+    )
+
     def generate_is_number(self):
-        unique_code = unique_model.get(self.type_of_extinguisher, 'UNK')
-        return f'ISN-{unique_code}-{self.cylinder_number}'
+        return build_is_number(self.type_of_extinguisher, self.cylinder_number)
+
+
+def build_is_number(type_of_extinguisher: str, cylinder_number: str) -> str:
+    unique_code = unique_model.get(type_of_extinguisher, 'UNK')
+    return f'ISN-{unique_code}-{cylinder_number}'
+
+
+# gin_trgm_ops needs the pg_trgm extension before the indexes above are created
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
 
 
 class MonthlyActivity(Base):
@@ -136,11 +177,25 @@ class MonthlyActivity(Base):
     complaints = Column(String(255))
     inspectors_name = Column(String(50), nullable=False)
     additional_info = Column(JSON, default=dict)
+    # weight/pressure parsed and converted to kg and bar by measurements.py, for SQL analytics
+    weight_kg = Column(Float, nullable=True)
+    pressure_bar = Column(Float, nullable=True)
+    # Client-generated key of a batch-synced record, so a retried sync does not insert it twice
+    idempotency_key = Column(String(64), nullable=True)
     
     fire_extinguisher = relationship("FireExtinguisher", back_populates="monthly_activities")
     
     # Relationship to store multiple images
     images = relationship("MonthlyActivityImage", back_populates="monthly_activity", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # Serves the latest-inspection lookup and date-range filters per extinguisher
+        Index("ix_monthlyactivity_is_number_inspection_date", "is_number", "inspection_date"),
+        # Lapsed-inspection scans of the reminder job
+        Index("ix_monthlyactivity_due_date", "due_date", "id"),
+        # A unique index rather than an inline UNIQUE so add-columns can create it on existing tables
+        Index("ix_monthlyactivity_idempotency_key", "idempotency_key", unique=True),
+    )
     
 
 class MonthlyActivityImage(Base):
@@ -148,7 +203,75 @@ class MonthlyActivityImage(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     monthly_activity_id = Column(Integer, ForeignKey('monthlyactivity.id'), nullable=False)
-    image_data = Column(LargeBinary, nullable=False)
+    # Legacy inline bytes; new images live in the blob store and only keep metadata here
+    image_data = deferred(Column(LargeBinary, nullable=True))
+    sha256 = Column(String(64), index=True)  # Content address in the blob store
+    size = Column(Integer)
+    mime_type = Column(String(100))
+    width = Column(Integer)
+    height = Column(Integer)
     description = Column(String(255))  # Optional: description or type of image
     
-    monthly_activity = relationship("MonthlyActivity", back_populates="images")
\ No newline at end of file
+    monthly_activity = relationship("MonthlyActivity", back_populates="images")
+
+    # Downscaled copies generated in the background after upload
+    variants = relationship("MonthlyActivityImageVariant", back_populates="image", cascade="all, delete-orphan")
+
+
+class MonthlyActivityImageVariant(Base):
+    __tablename__ = 'monthly_activity_image_variants'
+
+    id = Column(Integer, primary_key=True, index=True)
+    image_id = Column(Integer, ForeignKey('monthly_activity_images.id'), nullable=False)
+    variant = Column(String(20), nullable=False)  # thumbnail, medium
+    sha256 = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    mime_type = Column(String(100), nullable=False)
+    width = Column(Integer)
+    height = Column(Integer)
+
+    image = relationship("MonthlyActivityImage", back_populates="variants")
+
+    __table_args__ = (
+        UniqueConstraint("image_id", "variant", name="uq_monthly_activity_image_variant"),
+    )
+
+
+class ComplianceStatus(Base):
+    __tablename__ = 'compliance_status'
+
+    # One row per extinguisher, kept up to date whenever its inspections change
+    is_number = Column(String(50), ForeignKey('fireextinguisher.is_number'), primary_key=True)
+    latest_activity_id = Column(Integer, nullable=True)
+    defects = Column(JSON, default=list)
+    non_compliant = Column(Boolean, nullable=False, default=True)
+    computed_at = Column(DateTime, nullable=False)
+
+
+class RevokedToken(Base):
+    __tablename__ = 'revoked_tokens'
+
+    # Logged out tokens, kept until their exp so the table stays small
+    jti = Column(String(64), primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, index=True)  # Lets workers load only the revocations added since their last refresh
+
+
+class ReminderState(Base):
+    __tablename__ = 'reminder_state'
+
+    # High-water mark of the reminder job: every due date up to high_water_date has been notified
+
+    kind = Column(String(20), primary_key=True)
+    high_water_date = Column(Date, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class DashboardRollup(Base):
+    __tablename__ = 'dashboard_rollups'
+
+    # Per-admin counters behind the dashboard, adjusted by rollups.py on every write
+    admin_id = Column(Integer, ForeignKey('admin.id'), primary_key=True)
+    dimension = Column(String(30), primary_key=True)
+    key = Column(String(100), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
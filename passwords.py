@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# bcrypt releases the GIL, so hashing on these threads leaves the event loop free for other requests
+executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+# Hashing jobs queued or running; beyond PASSWORD_HASH_MAX_PENDING callers are turned away instead of queueing.
+# Only touched from the event loop thread, so no lock is needed.
+_pending = 0
+
+
+def hash_password_sync(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=settings.BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def verify_password_sync(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+async def _run_in_executor(func, *args):
+    global _pending
+    if _pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        logger.warning(f"Password hashing queue full ({_pending} pending)")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run_in_executor(hash_password_sync, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await _run_in_executor(verify_password_sync, password, hashed_password)
+
+
+async def verify_and_upgrade(db: AsyncSession, account, password: str) -> bool:
+    # Verifies the password of an Admin/User/SuperAdmin and rehashes it when BCRYPT_ROUNDS has changed
+    if not await verify_password(password, account.hashed_password):
+        return False
+    if needs_rehash(account.hashed_password):
+        account.hashed_password = await hash_password(password)
+        await db.commit()
+        await db.refresh(account)
+    return True
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+from abc import ABC, abstractmethod
+from contextlib import suppress
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+import models
+import compliance
+from config import settings
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Extinguisher dates that get a reminder REMINDER_LEAD_DAYS before they are due
+DUE_DATE_COLUMNS = {
+    "refilling": models.FireExtinguisher.due_of_refilling,
+    "hpt": models.FireExtinguisher.due_of_hpt,
+    "expiry": models.FireExtinguisher.expiry_date,
+}
+
+# Monthly inspections are reported once the due date of the latest inspection has passed
+INSPECTION_KIND = "inspection"
+
+REMINDER_KINDS = [*DUE_DATE_COLUMNS, INSPECTION_KIND]
+
+
+@dataclass(frozen=True)
+class ReminderItem:
+    kind: str
+    is_number: str
+    location: str
+    location_tag_number: str
+    due_date: date
+
+
+@dataclass
+class Notification:
+    # Everything that became due for one admin during a run, delivered as a single message
+    admin_id: int
+    username: Optional[str] = None
+    email: Optional[str] = None
+    items: List[ReminderItem] = field(default_factory=list)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class NotificationSink(ABC):
+    @abstractmethod
+    def send(self, notifications: List[Notification]):
+        raise NotImplementedError
+
+
+class LogSink(NotificationSink):
+    def send(self, notifications: List[Notification]):
+        for notification in notifications:
+            kinds = sorted({item.kind for item in notification.items})
+            logger.info(
+                f"Reminder for admin {notification.admin_id} ({notification.email}): "
+                f"{len(notification.items)} items due ({', '.join(kinds)})"
+            )
+
+
+class FileSink(NotificationSink):
+    # One JSON line per notification, meant for local testing
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, notifications: List[Notification]):
+        with open(self.path, "a", encoding="utf-8") as file:
+            for notification in notifications:
+                file.write(json.dumps(notification.to_dict(), default=str) + "\n")
+
+
+SINKS = {
+    "log": LogSink,
+    "file": lambda: FileSink(settings.REMINDER_FILE_PATH),
+}
+
+_notification_sink: Optional[NotificationSink] = None
+
+
+def get_notification_sink() -> NotificationSink:
+    global _notification_sink
+    if _notification_sink is None:
+        sink = SINKS.get(settings.REMINDER_SINK)
+        if sink is None:
+            raise ValueError(f"Unknown reminder sink: {settings.REMINDER_SINK}")
+        _notification_sink = sink()
+    return _notification_sink
+
+
+def window_end(kind: str, today: date) -> date:
+    if kind == INSPECTION_KIND:
+        # Lapsed: the due date is over and no newer inspection replaced it
+        return today - timedelta(days=1)
+    return today + timedelta(days=settings.REMINDER_LEAD_DAYS)
+
+
+def seed_states_statement(dialect_name: str):
+    # INSERT ... ON CONFLICT DO NOTHING: the first runs create the state rows exactly once, a concurrent
+    # run waits for the inserting transaction instead of starting from the same initial marks
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"Reminders are not supported on {dialect_name}")
+    return insert(models.ReminderState).on_conflict_do_nothing(index_elements=[models.ReminderState.kind])
+
+
+def load_states(db: Session, today: date) -> Dict[str, models.ReminderState]:
+    # The row locks serialize concurrent runs (several API processes, the worker) until the new
+    # high-water marks are committed, so a due date is only notified once. Rows are seeded first because
+    # FOR UPDATE cannot lock rows that do not exist yet.
+    db.execute(seed_states_statement(db.get_bind().dialect.name), [
+        {
+            "kind": kind,
+            "high_water_date": today - timedelta(days=settings.REMINDER_INITIAL_LOOKBACK_DAYS),
+            "updated_at": datetime.utcnow(),
+        }
+        for kind in REMINDER_KINDS
+    ])
+    return {state.kind: state for state in db.query(models.ReminderState).with_for_update()}
+
+
+def due_query(db: Session, kind: str):
+    if kind == INSPECTION_KIND:
+        due_column = models.MonthlyActivity.due_date
+        query = (
+            db.query(
+                models.FireExtinguisher.admin_id,
+                models.FireExtinguisher.is_number,
+                models.FireExtinguisher.location,
+                models.FireExtinguisher.location_tag_number,
+                due_column.label("due_date"),
+                models.MonthlyActivity.id.label("row_id"),
+            )
+            .join(models.FireExtinguisher, models.FireExtinguisher.is_number == models.MonthlyActivity.is_number)
+            .filter(models.MonthlyActivity.id == compliance.latest_activity_id(models.FireExtinguisher.is_number))
+        )
+        return query, due_column, models.MonthlyActivity.id
+    due_column = DUE_DATE_COLUMNS[kind]
+    query = db.query(
+        models.FireExtinguisher.admin_id,
+        models.FireExtinguisher.is_number,
+        models.FireExtinguisher.location,
+        models.FireExtinguisher.location_tag_number,
+        due_column.label("due_date"),
+        models.FireExtinguisher.id.label("row_id"),
+    )
+    return query, due_column, models.FireExtinguisher.id
+
+
+def scan_window(db: Session, kind: str, start: date, end: date) -> Iterator:
+    # Rows with start < due date <= end, read in keyset batches over the (due date, id) index
+    query, due_column, id_column = due_query(db, kind)
+    query = query.filter(due_column > start, due_column <= end)
+    after = None
+    while True:
+        batch_query = query
+        if after is not None:
+            batch_query = batch_query.filter(tuple_(due_column, id_column) > after)
+        batch = batch_query.order_by(due_column, id_column).limit(settings.REMINDER_BATCH_SIZE).all()
+        if not batch:
+            return
+        yield from batch
+        after = (batch[-1].due_date, batch[-1].row_id)
+
+
+def run_reminders(db: Session, sink: NotificationSink, today: Optional[date] = None) -> int:
+    # One incremental pass: every kind is scanned from its high-water mark up to its window end, the
+    # matches are grouped per admin and sent, then the marks are advanced. A failure before the commit
+    # leaves the marks untouched, so the window is retried (at-least-once delivery).
+    today = today or date.today()
+    states = load_states(db, today)
+
+    notifications: Dict[int, Notification] = {}
+    for kind in REMINDER_KINDS:
+        end = window_end(kind, today)
+        if end <= states[kind].high_water_date:
+            continue
+        for row in scan_window(db, kind, states[kind].high_water_date, end):
+            notification = notifications.setdefault(row.admin_id, Notification(admin_id=row.admin_id))
+            notification.items.append(ReminderItem(
+                kind=kind,
+                is_number=row.is_number,
+                location=row.location,
+                location_tag_number=row.location_tag_number,
+                due_date=row.due_date,
+            ))
+        states[kind].high_water_date = end
+        states[kind].updated_at = datetime.utcnow()
+
+    if notifications:
+        admins = db.query(models.Admin.id, models.Admin.username, models.Admin.email).filter(
+            models.Admin.id.in_([admin_id for admin_id in notifications if admin_id is not None])
+        )
+        for admin_id, username, email in admins:
+            notifications[admin_id].username = username
+            notifications[admin_id].email = email
+        sink.send(list(notifications.values()))
+
+    db.commit()
+    return sum(len(notification.items) for notification in notifications.values())
+
+
+def run_once() -> int:
+    db = SessionLocal()
+    try:
+        total = run_reminders(db, get_notification_sink())
+    finally:
+        db.close()
+    if total:
+        logger.info(f"Sent reminders for {total} due items")
+    return total
+
+
+async def reminder_loop(interval_seconds: int):
+    # In-process scheduler: the scan itself is blocking database work, so it runs in the default executor
+    loop = asyncio.get_running_loop()
+    while True:
+        run = loop.run_in_executor(None, run_once)
+        try:
+            await asyncio.shield(run)
+        except asyncio.CancelledError:
+            # The executor thread cannot be interrupted: let the run finish before the task stops
+            with suppress(Exception):
+                await run
+            raise
+        except Exception:
+            logger.exception("Reminder run failed")
+        await asyncio.sleep(interval_seconds)
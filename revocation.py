@@ -0,0 +1,209 @@
+import hashlib
+import heapq
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import models
+from config import settings
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationStore(ABC):
+    # Revoked token ids (JWT jti) are only kept until the token would have expired anyway
+    @abstractmethod
+    def revoke(self, jti: str, expires_at: float):
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_revoked(self, jti: str) -> bool:
+        raise NotImplementedError
+
+
+class MemoryRevocationStore(RevocationStore):
+    # Process-local store: jtis are grouped into buckets by expiry time and a whole bucket is dropped
+    # once it has expired, so memory stays proportional to the tokens that are still valid
+    BUCKET_SECONDS = 60
+
+    def __init__(self):
+        self._buckets = {}
+        self._bucket_ends = []
+        self._lock = threading.Lock()
+
+    def _purge(self, now: float):
+        while self._bucket_ends and self._bucket_ends[0] <= now:
+            del self._buckets[heapq.heappop(self._bucket_ends)]
+
+    def revoke(self, jti: str, expires_at: float):
+        now = time.time()
+        if expires_at <= now:
+            return
+        bucket_end = math.ceil(expires_at / self.BUCKET_SECONDS) * self.BUCKET_SECONDS
+        with self._lock:
+            self._purge(now)
+            if bucket_end not in self._buckets:
+                self._buckets[bucket_end] = set()
+                heapq.heappush(self._bucket_ends, bucket_end)
+            self._buckets[bucket_end].add(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        with self._lock:
+            self._purge(time.time())
+            return any(jti in bucket for bucket in self._buckets.values())
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:16], "big")
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+
+class DatabaseRevocationStore(RevocationStore):
+    # Shared between workers through the revoked_tokens table. Each worker keeps a bloom filter of the
+    # unexpired revocations, so the common "not revoked" answer needs no query. Every
+    # REVOCATION_REFRESH_SECONDS it only loads the rows revoked since the previous refresh; the filter is
+    # rebuilt from scratch every REBUILD_SECONDS, or once it is full, to drop expired entries. Revocations
+    # made by other workers become visible within one refresh interval.
+    PURGE_INTERVAL_SECONDS = 300
+    REBUILD_SECONDS = 3600
+    # revoked_at comes from the revoking worker's clock and rows may commit late, so incremental loads
+    # look back this far before the previous load
+    WATERMARK_OVERLAP_SECONDS = 60
+
+    def __init__(self, refresh_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self._bloom: Optional[BloomFilter] = None
+        self._bloom_entries = 0
+        self._watermark: Optional[datetime] = None
+        self._refreshed_at = 0.0
+        self._rebuilt_at = 0.0
+        self._purged_at = 0.0
+        # jtis revoked by this worker while a rebuild is loading, added to the new filter before it is swapped in
+        self._revoked_during_rebuild: Optional[List[str]] = None
+        # _lock only guards the filter itself; _refresh_lock lets a single thread query the table at a time
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _load(self, since: Optional[datetime]) -> List[str]:
+        db = SessionLocal()
+        try:
+            query = db.query(models.RevokedToken.jti).filter(models.RevokedToken.expires_at > datetime.utcnow())
+            if since is not None:
+                query = query.filter(models.RevokedToken.revoked_at >= since)
+            return [jti for (jti,) in query]
+        finally:
+            db.close()
+
+    def _refresh(self, now: float):
+        # Runs under _refresh_lock only; requests keep checking the current filter meanwhile
+        started_at = datetime.utcnow()
+        rebuild = (
+            self._bloom is None
+            or now - self._rebuilt_at > self.REBUILD_SECONDS
+            or self._bloom_entries > self._bloom.capacity
+        )
+        if not rebuild:
+            jtis = self._load(self._watermark - timedelta(seconds=self.WATERMARK_OVERLAP_SECONDS))
+            with self._lock:
+                for jti in jtis:
+                    self._bloom.add(jti)
+                self._bloom_entries += len(jtis)
+            self._watermark, self._refreshed_at = started_at, now
+            return
+
+        with self._lock:
+            self._revoked_during_rebuild = []
+        jtis = self._load(None)
+        bloom = BloomFilter(capacity=max(1024, len(jtis) * 2))
+        for jti in jtis:
+            bloom.add(jti)
+        with self._lock:
+            for jti in self._revoked_during_rebuild:
+                bloom.add(jti)
+            self._bloom, self._bloom_entries = bloom, len(jtis) + len(self._revoked_during_rebuild)
+            self._revoked_during_rebuild = None
+        self._watermark, self._refreshed_at, self._rebuilt_at = started_at, now, now
+
+    def revoke(self, jti: str, expires_at: float):
+        now = time.time()
+        if expires_at <= now:
+            return
+        db = SessionLocal()
+        try:
+            if db.get(models.RevokedToken, jti) is None:
+                db.add(models.RevokedToken(
+                    jti=jti, expires_at=datetime.utcfromtimestamp(expires_at), revoked_at=datetime.utcnow(),
+                ))
+            if now - self._purged_at > self.PURGE_INTERVAL_SECONDS:
+                # Expired revocations are useless, the token itself no longer validates
+                db.query(models.RevokedToken).filter(models.RevokedToken.expires_at <= datetime.utcnow()).delete()
+                self._purged_at = now
+            db.commit()
+        finally:
+            db.close()
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+                self._bloom_entries += 1
+            if self._revoked_during_rebuild is not None:
+                self._revoked_during_rebuild.append(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        now = time.time()
+        if self._bloom is None or now - self._refreshed_at > self.refresh_seconds:
+            # One thread reloads while the others keep answering from the current filter; only the very
+            # first load, when there is no filter yet, makes them wait
+            if self._refresh_lock.acquire(blocking=self._bloom is None):
+                try:
+                    if self._bloom is None or now - self._refreshed_at > self.refresh_seconds:
+                        self._refresh(now)
+                finally:
+                    self._refresh_lock.release()
+        with self._lock:
+            if jti not in self._bloom:
+                return False
+        # Possible hit (or bloom false positive): confirm against the table
+        db = SessionLocal()
+        try:
+            revoked = db.get(models.RevokedToken, jti)
+            return revoked is not None and revoked.expires_at > datetime.utcnow()
+        finally:
+            db.close()
+
+
+BACKENDS = {
+    "memory": MemoryRevocationStore,
+    "database": lambda: DatabaseRevocationStore(settings.REVOCATION_REFRESH_SECONDS),
+}
+
+_revocation_store: Optional[RevocationStore] = None
+
+
+def get_revocation_store() -> RevocationStore:
+    global _revocation_store
+    if _revocation_store is None:
+        backend = BACKENDS.get(settings.REVOCATION_BACKEND)
+        if backend is None:
+            raise ValueError(f"Unknown revocation backend: {settings.REVOCATION_BACKEND}")
+        _revocation_store = backend()
+    return _revocation_store
@@ -0,0 +1,114 @@
+from collections import Counter
+from datetime import date
+from typing import Dict, List, Mapping
+from sqlalchemy import case, delete, func, literal, select
+from sqlalchemy.orm import Session
+import models
+
+# Extinguisher attributes counted on the dashboard
+FIRE_EXTINGUISHER_DIMENSIONS = {
+    "type_of_extinguisher": models.FireExtinguisher.type_of_extinguisher,
+    "location": models.FireExtinguisher.location,
+    "service_provider": models.FireExtinguisher.service_provider,
+}
+COMPLIANCE = "compliance"
+INSPECTION_MONTH = "inspection_month"
+
+ROLLUP_TABLE = models.DashboardRollup.__table__
+
+
+def compliance_key(non_compliant: bool) -> str:
+    return "non_compliant" if non_compliant else "compliant"
+
+
+def month_key(inspection_date: date) -> str:
+    return inspection_date.strftime("%Y-%m")
+
+
+def registered_deltas(admin_id: int, values: Mapping) -> Counter:
+    # Counters of a newly registered extinguisher, which starts out non-compliant (see compliance.initial_status)
+    deltas = Counter({(admin_id, COMPLIANCE, compliance_key(True)): 1})
+    for dimension in FIRE_EXTINGUISHER_DIMENSIONS:
+        deltas[(admin_id, dimension, values[dimension])] += 1
+    return deltas
+
+
+def inspection_delta(admin_id: int, inspection_date: date, change: int = 1) -> Counter:
+    return Counter({(admin_id, INSPECTION_MONTH, month_key(inspection_date)): change})
+
+
+def upsert_statement(dialect_name: str):
+    # INSERT ... ON CONFLICT DO UPDATE adds to the stored count atomically, concurrent writers never lose updates
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"Dashboard rollups are not supported on {dialect_name}")
+    statement = insert(ROLLUP_TABLE)
+    return statement.on_conflict_do_update(
+        index_elements=[ROLLUP_TABLE.c.admin_id, ROLLUP_TABLE.c.dimension, ROLLUP_TABLE.c.key],
+        set_={"count": ROLLUP_TABLE.c.count + statement.excluded["count"]},
+    )
+
+
+def apply_deltas(db: Session, deltas: Dict):
+    # Adds {(admin_id, dimension, key): change} to the rollups in the caller's transaction
+    rows = [
+        {"admin_id": admin_id, "dimension": dimension, "key": key, "count": change}
+        for (admin_id, dimension, key), change in deltas.items()
+        if change and admin_id is not None and key is not None
+    ]
+    if not rows:
+        return
+    db.execute(upsert_statement(db.get_bind().dialect.name), rows)
+    decremented = {row["admin_id"] for row in rows if row["count"] < 0}
+    if decremented:
+        db.execute(
+            delete(models.DashboardRollup).where(
+                models.DashboardRollup.admin_id.in_(decremented),
+                models.DashboardRollup.count <= 0,
+            )
+        )
+
+
+def month_expression(dialect_name: str, column):
+    if dialect_name == "postgresql":
+        return func.to_char(column, "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+
+def rebuild_rollups(db: Session) -> int:
+    # Recompute every counter from the source tables with INSERT ... SELECT ... GROUP BY
+    dialect_name = db.get_bind().dialect.name
+    fire_extinguisher = models.FireExtinguisher
+    sources: List = [
+        select(fire_extinguisher.admin_id, literal(dimension), column, func.count())
+        .where(fire_extinguisher.admin_id.isnot(None))
+        .group_by(fire_extinguisher.admin_id, column)
+        for dimension, column in FIRE_EXTINGUISHER_DIMENSIONS.items()
+    ]
+    sources.append(
+        select(
+            fire_extinguisher.admin_id,
+            literal(COMPLIANCE),
+            case((models.ComplianceStatus.non_compliant, compliance_key(True)), else_=compliance_key(False)),
+            func.count(),
+        )
+        .join(models.ComplianceStatus, models.ComplianceStatus.is_number == fire_extinguisher.is_number)
+        .where(fire_extinguisher.admin_id.isnot(None))
+        .group_by(fire_extinguisher.admin_id, models.ComplianceStatus.non_compliant)
+    )
+    month = month_expression(dialect_name, models.MonthlyActivity.inspection_date)
+    sources.append(
+        select(fire_extinguisher.admin_id, literal(INSPECTION_MONTH), month, func.count())
+        .join(models.MonthlyActivity, models.MonthlyActivity.is_number == fire_extinguisher.is_number)
+        .where(fire_extinguisher.admin_id.isnot(None))
+        .group_by(fire_extinguisher.admin_id, month)
+    )
+
+    db.execute(delete(models.DashboardRollup))
+    for source in sources:
+        db.execute(ROLLUP_TABLE.insert().from_select(["admin_id", "dimension", "key", "count"], source))
+    db.commit()
+    return db.query(func.count()).select_from(models.DashboardRollup).scalar()
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 from typing import List
 from datetime import date, timedelta
 from jose import JWTError, jwt
@@ -8,7 +10,8 @@ import logging
 
 import models
 import schemas
-from dependencies import get_db
+from dependencies import get_db, get_async_db, get_async_read_db
+from passwords import hash_password, verify_and_upgrade
 from utils import create_access_token, blacklist_token, is_token_blacklisted
 
 logger = logging.getLogger(__name__)
@@ -17,9 +20,20 @@ oauth2_scheme_admin = OAuth2PasswordBearer(tokenUrl="/admins/login")
 
 router = APIRouter()
 
+
+def admin_history_options():
+    # AdminResponse nests extinguishers, their inspections and images; async sessions cannot lazy load them
+    return [
+        selectinload(models.Admin.fire_extinguishers)
+        .selectinload(models.FireExtinguisher.monthly_activities)
+        .selectinload(models.MonthlyActivity.images)
+        .selectinload(models.MonthlyActivityImage.variants),
+    ]
+
+
 @router.post("/login", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    admin = authenticate_admin(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    admin = await authenticate_admin(db, form_data.username, form_data.password)
     if not admin:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -32,18 +46,19 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     return {"access_token": access_token, "token_type": "bearer", "admin_id": admin.id, "location": admin.location}
 
-def authenticate_admin(db: Session, username: str, password: str):
-    admin = db.query(models.Admin).filter(models.Admin.username == username).first()
+async def authenticate_admin(db: AsyncSession, username: str, password: str):
+    result = await db.execute(select(models.Admin).where(models.Admin.username == username))
+    admin = result.scalars().first()
     if not admin:
         logger.info(f"Admin not found for username: {username}")
         return False
-    if not admin.check_password(password):
+    if not await verify_and_upgrade(db, admin, password):
         logger.info(f"Password mismatch for username: {username}")
         return False
     return admin
 
 @router.post("/logout")
-async def logout(token: str = Depends(oauth2_scheme_admin)):
+def logout(token: str = Depends(oauth2_scheme_admin)):
     if is_token_blacklisted(token):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -53,8 +68,9 @@ async def logout(token: str = Depends(oauth2_scheme_admin)):
     return {"msg": "Logged out successfully"}
 
 @router.post("/", response_model=schemas.AdminResponse)
-async def create_admin(admin: schemas.AdminCreate, db: Session = Depends(get_db)):
-    db_admin = db.query(models.Admin).filter(models.Admin.username == admin.username).first()
+async def create_admin(admin: schemas.AdminCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(models.Admin).where(models.Admin.username == admin.username))
+    db_admin = result.scalars().first()
     if db_admin:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered")
     new_admin = models.Admin(
@@ -67,20 +83,21 @@ async def create_admin(admin: schemas.AdminCreate, db: Session = Depends(get_db)
         created_at=date.today(),
         updated_at=date.today()
     )
-    new_admin.set_password(admin.password)
+    new_admin.hashed_password = await hash_password(admin.password)
     db.add(new_admin)
-    db.commit()
-    db.refresh(new_admin)
+    await db.commit()
+    await db.refresh(new_admin, ["fire_extinguishers"])
     return new_admin
 
 @router.get("/", response_model=List[schemas.AdminResponse])
-async def read_admins(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    admins = db.query(models.Admin).offset(skip).limit(limit).all()
-    return admins
+async def read_admins(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_async_read_db)):
+    result = await db.execute(select(models.Admin).options(*admin_history_options()).offset(skip).limit(limit))
+    return result.scalars().all()
 
 @router.get("/admin_list", response_model=List[schemas.AdminListResponse])
-async def read_admins(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    admins = db.query(models.Admin).offset(skip).limit(limit).all()
+async def read_admins(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_async_read_db)):
+    result = await db.execute(select(models.Admin).offset(skip).limit(limit))
+    admins = result.scalars().all()
     admin_lists = [
         {
             "username": admin.username,
@@ -92,7 +109,7 @@ async def read_admins(skip: int = 0, limit: int = 10, db: Session = Depends(get_
     return admin_lists
 
 @router.get("/protected")
-async def protected_route(request: Request, db: Session = Depends(get_db)):
+def protected_route(request: Request, db: Session = Depends(get_db)):
     token = request.headers.get("Authorization")
     if token and token.startswith("Bearer "):
         token = token[len("Bearer "):]
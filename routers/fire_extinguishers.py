@@ -1,13 +1,24 @@
-from datetime import datetime
-from fastapi import APIRouter, HTTPException, Depends,  HTTPException, Query, Request, status
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from datetime import date, datetime, timedelta
+from itertools import compress
+from zipfile import BadZipFile
+from fastapi import APIRouter, HTTPException, Depends,  HTTPException, File, Query, Request, UploadFile, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, load_only, selectinload
 from typing import List, Dict, Any, Optional
 import models
 import schemas
+import compliance
+import due_dates
+import measurements
+import rollups
+import licenses
+import importer
 import logging
-from sqlalchemy import desc
-from dependencies import get_db, get_current_admin
+import json
+from sqlalchemy import case, desc, func, literal, or_, select, tuple_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import ReadSessionLocal
+from dependencies import AdminPrincipal, get_db, get_async_db, get_async_read_db, get_current_admin
 
 logger = logging.getLogger(__name__)
 
@@ -24,127 +35,181 @@ router = APIRouter()
 #     return db_fire_extinguisher
 
 @router.post("/", response_model=schemas.FireExtinguisherResponse)
-async def create_fire_extinguisher(
+def create_fire_extinguisher(
     fire_extinguisher: schemas.FireExtinguisherCreate,
     db: Session = Depends(get_db),
-    current_admin: models.Admin = Depends(get_current_admin),
+    current_admin: AdminPrincipal = Depends(get_current_admin),
 ):
-    # Count the fire extinguishers already created by the admin
-    extinguisher_count = db.query(models.FireExtinguisher).filter_by(admin_id=current_admin.id).count()
-    
-    # Check if the admin has reached their license limit
-    if extinguisher_count >= current_admin.license_limit:
+    # Plain def: the license reservation, status writes and commit use a sync session, keep them off the event loop
+    # Take one license atomically; fails if the admin has reached their license limit
+    if not licenses.reserve_licenses(db, current_admin.id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"You have reached the limit of {current_admin.license_limit} fire extinguishers."
+            detail=f"You have reached the limit of {licenses.license_limit(db, current_admin.id)} fire extinguishers."
         )
     
     # Proceed with creating the fire extinguisher
     db_fire_extinguisher = models.FireExtinguisher(**fire_extinguisher.model_dump(), admin_id=current_admin.id)
     db_fire_extinguisher.is_number = db_fire_extinguisher.generate_is_number()
+    due_dates.apply_next_due(db_fire_extinguisher)
+    measurements.apply_fire_extinguisher_measurements(db_fire_extinguisher)
     db.add(db_fire_extinguisher)
+    db.add(compliance.initial_status(db_fire_extinguisher.is_number))
+    rollups.apply_deltas(db, rollups.registered_deltas(current_admin.id, fire_extinguisher.model_dump()))
     db.commit()
     db.refresh(db_fire_extinguisher)
     return db_fire_extinguisher
 
+IMPORT_FORMATS = {
+    "csv": importer.iter_csv_rows,
+    "xlsx": importer.iter_xlsx_rows,
+}
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+@router.post("/import", response_model=schemas.FireExtinguisherImportResponse)
+def import_fire_extinguishers(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_admin: AdminPrincipal = Depends(get_current_admin),
+):
+    # Bulk registration from a CSV or XLSX sheet with the FireExtinguisherCreate columns.
+    # Plain def: parsing and the chunked inserts run in the threadpool, not on the event loop.
+    filename = (file.filename or "").lower()
+    if filename.endswith(".xlsx") or file.content_type == XLSX_CONTENT_TYPE:
+        file_format = "xlsx"
+    elif filename.endswith(".csv") or file.content_type in ("text/csv", "application/vnd.ms-excel", None):
+        file_format = "csv"
+    else:
+        raise HTTPException(status_code=400, detail="Upload a .csv or .xlsx file")
+
+    try:
+        rows = IMPORT_FORMATS[file_format](file.file)
+        result = importer.FireExtinguisherImport(db, current_admin.id).run(rows)
+    except (UnicodeDecodeError, ValueError, BadZipFile) as e:
+        db.rollback()
+        logger.info(f"Unreadable {file_format} import from admin {current_admin.id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Could not read the {file_format} file")
+    logger.info(f"Imported {result.inserted} fire extinguishers for admin {current_admin.id}, {result.failed} rows failed")
+    return result
+
 @router.get("/{is_number}", response_model=schemas.FireExtinguisherSummaryResponse)
-async def read_fire_extinguisher_by_is_number(is_number: str, db: Session = Depends(get_db)):
-    # Query the fire extinguisher by its is_number
-    fire_extinguisher = db.query(models.FireExtinguisher).filter(models.FireExtinguisher.is_number == is_number).first()
-    
-    if fire_extinguisher is None:
+async def read_fire_extinguisher_by_is_number(is_number: str, db: AsyncSession = Depends(get_async_db)):
+    # Fetch the fire extinguisher together with its stored compliance status (primary-key join)
+    result = await db.execute(
+        select(models.FireExtinguisher, models.ComplianceStatus)
+        .outerjoin(models.ComplianceStatus, models.ComplianceStatus.is_number == models.FireExtinguisher.is_number)
+        .where(models.FireExtinguisher.is_number == is_number)
+    )
+    row = result.first()
+
+    if row is None:
         raise HTTPException(status_code=404, detail="Fire extinguisher not found")
 
-    # Check if there are any monthly activities
-    if len(fire_extinguisher.monthly_activities) > 0:
-        last_updated_data = fire_extinguisher.monthly_activities[-1]
+    fire_extinguisher, status = row
+
+    if status is not None:
+        latest_id, failed_checks, non_compliant = status.latest_activity_id, status.defects, status.non_compliant
     else:
-        # If no monthly activities exist, return the summary with a non-compliant flag
-        return schemas.FireExtinguisherSummaryResponse(
-            sl_no=fire_extinguisher.id,
-            serial_no=fire_extinguisher.is_number,
-            location_name=fire_extinguisher.location,
-            location_tag_no=fire_extinguisher.location_tag_number,
-            cylinder_number=fire_extinguisher.cylinder_number,
-            date_of_refilling=fire_extinguisher.date_of_refilling,
-            due_of_refilling=fire_extinguisher.due_of_refilling,
-            type_of_extinguisher=fire_extinguisher.type_of_extinguisher,
-            net_weight=fire_extinguisher.net_weight,
-            uom=fire_extinguisher.uom,
-            due_of_hpt=fire_extinguisher.due_of_hpt,
-            expiry_date=fire_extinguisher.expiry_date,
-            non_compliant=True  # Set non_compliant flag as True if no inspections
+        # Status not backfilled yet: evaluate the latest inspection on the fly
+        result = await db.execute(
+            select(models.MonthlyActivity)
+            .where(models.MonthlyActivity.id == compliance.latest_activity_id(fire_extinguisher.is_number))
         )
+        last_updated_data = result.scalars().first()
+        latest_id = last_updated_data.id if last_updated_data is not None else None
+        failed_checks, non_compliant = compliance.evaluate(last_updated_data)
 
-    # Check individual attributes in the latest inspection data (last_updated_data)
-    failed_checks = [
-        attr for attr in [
-            "cylinder_nozzle",
-            "operating_lever",
-            "safety_pin",
-            "pressure_gauge",
-        ] if not getattr(last_updated_data, attr)
-    ] + [
-        attr for attr in [
-            "paint_peeled_off",
-            "presence_of_rust",
-            "damaged_cylinder",
-            "dent_on_body",
-        ] if getattr(last_updated_data, attr)
-    ]
-    
-    # Remove items from failed_checks that are in additional_info
-    failed_checks = [item for item in failed_checks if item not in last_updated_data.additional_info]
-
-    # If there are no failed checks, return the fire extinguisher summary as compliant
+    # If there are no failed checks, return the fire extinguisher summary
+    # (never inspected extinguishers are returned with the non-compliant flag set)
     if not failed_checks:
-        return schemas.FireExtinguisherSummaryResponse(
-            sl_no=fire_extinguisher.id,
-            serial_no=fire_extinguisher.is_number,
-            location_name=fire_extinguisher.location,
-            location_tag_no=fire_extinguisher.location_tag_number,
-            cylinder_number=fire_extinguisher.cylinder_number,
-            date_of_refilling=fire_extinguisher.date_of_refilling,
-            due_of_refilling=fire_extinguisher.due_of_refilling,
-            type_of_extinguisher=fire_extinguisher.type_of_extinguisher,
-            net_weight=fire_extinguisher.net_weight,
-            uom=fire_extinguisher.uom,
-            due_of_hpt=fire_extinguisher.due_of_hpt,
-            expiry_date=fire_extinguisher.expiry_date,
-            non_compliant=False  # No failed checks means compliant
-        )
-
-    # Check if all the failed checks are in the additional_info, if so, return compliant
-    if all(item in last_updated_data.additional_info for item in failed_checks):
-        return schemas.FireExtinguisherSummaryResponse(
-            sl_no=fire_extinguisher.id,
-            serial_no=fire_extinguisher.is_number,
-            location_name=fire_extinguisher.location,
-            location_tag_no=fire_extinguisher.location_tag_number,
-            cylinder_number=fire_extinguisher.cylinder_number,
-            date_of_refilling=fire_extinguisher.date_of_refilling,
-            due_of_refilling=fire_extinguisher.due_of_refilling,
-            type_of_extinguisher=fire_extinguisher.type_of_extinguisher,
-            net_weight=fire_extinguisher.net_weight,
-            uom=fire_extinguisher.uom,
-            due_of_hpt=fire_extinguisher.due_of_hpt,
-            expiry_date=fire_extinguisher.expiry_date,
-            non_compliant=False  # Compliant since defects are acknowledged in additional_info
-        )
+        return fire_extinguisher_summary(fire_extinguisher, non_compliant=non_compliant)
 
     # If there are failed checks that are not covered in additional_info, raise an exception
     raise HTTPException(
         status_code=400,
         detail={
             "message": f"Fire extinguisher not compliant with safety standards:",
-            "id": fire_extinguisher.monthly_activities[-1].id,
+            "id": latest_id,
             "defects": failed_checks
         }
     )
 
 
+def fire_extinguisher_summary(fire_extinguisher: models.FireExtinguisher, non_compliant: bool):
+    return schemas.FireExtinguisherSummaryResponse(
+        sl_no=fire_extinguisher.id,
+        serial_no=fire_extinguisher.is_number,
+        location_name=fire_extinguisher.location,
+        location_tag_no=fire_extinguisher.location_tag_number,
+        cylinder_number=fire_extinguisher.cylinder_number,
+        date_of_refilling=fire_extinguisher.date_of_refilling,
+        due_of_refilling=fire_extinguisher.due_of_refilling,
+        type_of_extinguisher=fire_extinguisher.type_of_extinguisher,
+        net_weight=fire_extinguisher.net_weight,
+        uom=fire_extinguisher.uom,
+        due_of_hpt=fire_extinguisher.due_of_hpt,
+        expiry_date=fire_extinguisher.expiry_date,
+        non_compliant=non_compliant
+    )
+
+
+@router.get("/report/{admin_id}", response_model=schemas.ComplianceReportResponse)
+async def read_compliance_report(
+    admin_id: int,
+    as_of: Optional[date] = Query(None, description="Reference date for overdue checks, defaults to today"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    as_of = as_of or date.today()
+
+    # One query returns every extinguisher of the admin with its defect and due-date flags
+    # already evaluated by the database
+    result = await db.execute(
+        select(
+            models.FireExtinguisher.is_number,
+            models.ComplianceStatus.non_compliant,
+            models.FireExtinguisher.due_of_refilling < as_of,
+            models.FireExtinguisher.due_of_hpt < as_of,
+            models.FireExtinguisher.expiry_date < as_of,
+        )
+        .outerjoin(models.ComplianceStatus, models.ComplianceStatus.is_number == models.FireExtinguisher.is_number)
+        .where(models.FireExtinguisher.admin_id == admin_id)
+        .order_by(models.FireExtinguisher.id)
+    )
+    rows = result.all()
+
+    # Transpose into columns and select the offending serials column by column
+    serials, non_compliant, overdue_refilling, overdue_hpt, expired = (
+        [list(column) for column in zip(*rows)] if rows else ([], [], [], [], [])
+    )
+    if None in non_compliant:
+        # Status not backfilled yet: evaluate the latest inspection on the fly, like the QR scan does
+        result = await db.execute(compliance.unrecorded_latest_activities(models.FireExtinguisher.admin_id == admin_id))
+        evaluated = {is_number: compliance.evaluate(activity)[1] for is_number, activity in result.all()}
+        non_compliant = [
+            evaluated.get(serial, True) if flag is None else flag for serial, flag in zip(serials, non_compliant)
+        ]
+    non_compliant_serials = list(compress(serials, non_compliant))
+
+    return schemas.ComplianceReportResponse(
+        admin_id=admin_id,
+        as_of=as_of,
+        total=len(serials),
+        compliant=len(serials) - len(non_compliant_serials),
+        non_compliant=len(non_compliant_serials),
+        overdue_refilling=sum(map(bool, overdue_refilling)),
+        overdue_hpt=sum(map(bool, overdue_hpt)),
+        expired=sum(map(bool, expired)),
+        non_compliant_serials=non_compliant_serials,
+        overdue_refilling_serials=list(compress(serials, overdue_refilling)),
+        overdue_hpt_serials=list(compress(serials, overdue_hpt)),
+        expired_serials=list(compress(serials, expired)),
+    )
+
+
 @router.get("/web_old/{is_number}", response_model=schemas.FireExtinguisherSummaryResponse)
-async def read_fe_data_old_method(is_number: str, db: Session = Depends(get_db)):
+def read_fe_data_old_method(is_number: str, db: Session = Depends(get_db)):
     fire_extinguisher = db.query(models.FireExtinguisher).filter(models.FireExtinguisher.is_number == is_number).first()
     
     if fire_extinguisher is None:
@@ -167,25 +232,113 @@ async def read_fe_data_old_method(is_number: str, db: Session = Depends(get_db))
 
 
 @router.get("/web/{is_number}", response_model=schemas.FireExtinguisherResponse)
-async def read_fire_extinguisher_by_is_number(is_number: str, db: Session = Depends(get_db)):
-    fire_extinguisher = db.query(models.FireExtinguisher).filter(models.FireExtinguisher.is_number == is_number).first()
+async def read_fire_extinguisher_by_is_number(is_number: str, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(
+        select(models.FireExtinguisher)
+        .where(models.FireExtinguisher.is_number == is_number)
+        .options(*fire_extinguisher_history_options())
+    )
+    fire_extinguisher = result.scalars().first()
 
     if fire_extinguisher is None:
         raise HTTPException(status_code=404, detail="Fire extinguisher not found")
     
     return fire_extinguisher
 
+# Columns returned for each monthly activity by /filter, in response order
+FILTER_ACTIVITY_COLUMNS = (
+    models.MonthlyActivity.id,
+    models.MonthlyActivity.is_number,
+    models.MonthlyActivity.inspection_date,
+    models.MonthlyActivity.due_date,
+    models.MonthlyActivity.inspectors_name,
+    models.MonthlyActivity.weight,
+    models.MonthlyActivity.capacity_uom,
+    models.MonthlyActivity.pressure,
+    models.MonthlyActivity.operating_lever,
+    models.MonthlyActivity.safety_pin,
+    models.MonthlyActivity.pressure_gauge,
+    models.MonthlyActivity.cylinder_nozzle,
+    models.MonthlyActivity.paint_peeled_off,
+    models.MonthlyActivity.presence_of_rust,
+    models.MonthlyActivity.dent_on_body,
+    models.MonthlyActivity.damaged_cylinder,
+    models.MonthlyActivity.complaints,
+    models.MonthlyActivity.additional_info,
+)
+
+
+def filtered_activities_query(is_number: str, start_date_obj, end_date_obj, after):
+    # Date range and cursor are applied as SQL predicates served by the (is_number, inspection_date) index
+    query = select(*FILTER_ACTIVITY_COLUMNS).where(models.MonthlyActivity.is_number == is_number)
+    if start_date_obj:
+        query = query.where(models.MonthlyActivity.inspection_date >= start_date_obj)
+    if end_date_obj:
+        query = query.where(models.MonthlyActivity.inspection_date <= end_date_obj)
+    if after:
+        query = query.where(
+            tuple_(models.MonthlyActivity.inspection_date, models.MonthlyActivity.id) > after
+        )
+    return query.order_by(models.MonthlyActivity.inspection_date, models.MonthlyActivity.id)
+
+
+def format_activity(row) -> Dict[str, Any]:
+    activity_dict = row._asdict()
+    activity_dict["inspection_date"] = row.inspection_date.isoformat()
+    activity_dict["due_date"] = row.due_date.isoformat()
+    activity_dict["weight"] = str(row.weight)
+    return activity_dict
+
+
+def encode_cursor(activity_dict: Dict[str, Any]) -> str:
+    return f"{activity_dict['inspection_date']}:{activity_dict['id']}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        cursor_date, cursor_id = cursor.split(":")
+        return datetime.strptime(cursor_date, "%Y-%m-%d").date(), int(cursor_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def stream_filtered_activities(fire_ext_dict: Dict[str, Any], is_number: str, start_date_obj, end_date_obj, after, limit):
+    # Runs on its own session so rows are fetched in batches while the response is being sent
+    db = ReadSessionLocal()
+    try:
+        yield json.dumps({"fire_extinguisher": fire_ext_dict}) + "\n"
+        query = filtered_activities_query(is_number, start_date_obj, end_date_obj, after)
+        if limit:
+            query = query.limit(limit)
+        for row in db.execute(query.execution_options(yield_per=500)):
+            yield json.dumps(format_activity(row)) + "\n"
+    finally:
+        db.close()
+
+
 @router.get("/filter/{is_number}")
 async def filter_fire_extinguishers(
     is_number: str,
     start_date: Optional[str] = Query(None, description="Start date in YYYY-MM-DD format"),
     end_date: Optional[str] = Query(None, description="End date in YYYY-MM-DD format"),
-    db: Session = Depends(get_db)
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of activities to return"),
+    after: Optional[str] = Query(None, description="Cursor returned as next_cursor by the previous page"),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="json, or ndjson to stream one activity per line"),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
+    # Convert string dates to date objects for comparison
+    try:
+        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    after_key = decode_cursor(after) if after else None
+
     # Query the fire extinguisher
-    fire_extinguisher = db.query(models.FireExtinguisher).filter(
-        models.FireExtinguisher.is_number == is_number
-    ).first()
+    result = await db.execute(
+        select(models.FireExtinguisher).where(models.FireExtinguisher.is_number == is_number)
+    )
+    fire_extinguisher = result.scalars().first()
     
     if fire_extinguisher is None:
         raise HTTPException(status_code=404, detail="Fire extinguisher not found")
@@ -211,67 +364,356 @@ async def filter_fire_extinguishers(
         "admin_id": fire_extinguisher.admin_id
     }
 
-    # Get all monthly activities
-    activities = fire_extinguisher.monthly_activities if fire_extinguisher.monthly_activities else []
-    
-    # Convert string dates to datetime objects for comparison
-    try:
-        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
-        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    if format == "ndjson":
+        # First line is the fire extinguisher, followed by one monthly activity per line
+        return StreamingResponse(
+            stream_filtered_activities(fire_ext_dict, is_number, start_date_obj, end_date_obj, after_key, limit),
+            media_type="application/x-ndjson",
+        )
 
-    # Filter activities based on date range
-    filtered_activities = []
-    for activity in activities:
-        activity_date = activity.inspection_date
-        
-        # Check if the activity date falls within the range
-        if start_date_obj and end_date_obj:
-            if start_date_obj <= activity_date <= end_date_obj:
-                filtered_activities.append(activity)
-        elif start_date_obj and not end_date_obj:
-            if activity_date >= start_date_obj:
-                filtered_activities.append(activity)
-        elif end_date_obj and not start_date_obj:
-            if activity_date <= end_date_obj:
-                filtered_activities.append(activity)
-        else:
-            filtered_activities.append(activity)
-
-    # Convert filtered activities to list of dicts with proper formatting
-    formatted_activities = []
-    for activity in filtered_activities:
-        activity_dict = {
-            "id": activity.id,
-            "is_number": activity.is_number,
-            "inspection_date": activity.inspection_date.strftime("%Y-%m-%d"),
-            "due_date": activity.due_date.strftime("%Y-%m-%d"),
-            "inspectors_name": activity.inspectors_name,
-            "weight": str(activity.weight),
-            "capacity_uom": activity.capacity_uom,
-            "pressure": activity.pressure,
-            "operating_lever": activity.operating_lever,
-            "safety_pin": activity.safety_pin,
-            "pressure_gauge": activity.pressure_gauge,
-            "cylinder_nozzle": activity.cylinder_nozzle,
-            "paint_peeled_off": activity.paint_peeled_off,
-            "presence_of_rust": activity.presence_of_rust,
-            "dent_on_body": activity.dent_on_body,
-            "damaged_cylinder": activity.damaged_cylinder,
-            "complaints": activity.complaints,
-            "additional_info": activity.additional_info
-        }
-        formatted_activities.append(activity_dict)
+    # Fetch only the activities in range, one extra row tells whether another page exists
+    query = filtered_activities_query(is_number, start_date_obj, end_date_obj, after_key)
+    if limit:
+        query = query.limit(limit + 1)
+    result = await db.execute(query)
+    formatted_activities = [format_activity(row) for row in result]
+
+    next_cursor = None
+    if limit and len(formatted_activities) > limit:
+        formatted_activities = formatted_activities[:limit]
+        next_cursor = encode_cursor(formatted_activities[-1])
 
     # Add filtered activities to fire extinguisher dict
     fire_ext_dict["monthly_activities"] = formatted_activities
 
-    return {"fire_extinguisher": fire_ext_dict}
+    return {"fire_extinguisher": fire_ext_dict, "next_cursor": next_cursor}
+
+def fire_extinguisher_history_options():
+    # Nested history is loaded with one batched query per level instead of lazy loads per row
+    # (image bytes are deferred on the model, so only image metadata is fetched)
+    return [
+        selectinload(models.FireExtinguisher.monthly_activities)
+        .selectinload(models.MonthlyActivity.images)
+        .selectinload(models.MonthlyActivityImage.variants),
+    ]
+
 
 @router.get("/fe_data/{admin_id}", response_model=List[schemas.FireExtinguisherResponse])
-async def read_fire_extinguisher_by_admin_id(admin_id: int, db: Session = Depends(get_db)):
-    fire_extinguishers = db.query(models.FireExtinguisher).filter(models.FireExtinguisher.admin_id == admin_id).all()
+async def read_fire_extinguisher_by_admin_id(admin_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    result = await db.execute(
+        select(models.FireExtinguisher)
+        .where(models.FireExtinguisher.admin_id == admin_id)
+        .options(*fire_extinguisher_history_options())
+        .order_by(models.FireExtinguisher.id)
+    )
+    fire_extinguishers = result.scalars().all()
     if not fire_extinguishers:
         raise HTTPException(status_code=404, detail="Fire extinguishers not found")
-    return fire_extinguishers
\ No newline at end of file
+    return fire_extinguishers
+
+
+# Scalar fields that can be requested through fields= on /fe_list
+LISTING_FIELDS = [
+    name for name in schemas.FireExtinguisherResponse.model_fields if name != "monthly_activities"
+]
+LISTING_INCLUDES = ["monthly_activities", "monthly_activities.images"]
+
+
+def parse_csv_param(value: Optional[str], allowed: List[str], param: str) -> List[str]:
+    if not value:
+        return []
+    requested = [item.strip() for item in value.split(",") if item.strip()]
+    unknown = [item for item in requested if item not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown {param}: {', '.join(unknown)}")
+    return requested
+
+
+@router.get("/fe_list/{admin_id}", response_model=schemas.FireExtinguisherPageResponse)
+async def list_fire_extinguishers_by_admin_id(
+    admin_id: int,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[int] = Query(None, description="Cursor returned as next_cursor by the previous page"),
+    fields: Optional[str] = Query(None, description="Comma separated fire extinguisher fields, defaults to all"),
+    include: Optional[str] = Query(None, description="monthly_activities and/or monthly_activities.images"),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    requested_fields = parse_csv_param(fields, LISTING_FIELDS, "fields") or LISTING_FIELDS
+    includes = parse_csv_param(include, LISTING_INCLUDES, "include")
+    include_images = "monthly_activities.images" in includes
+    include_activities = include_images or "monthly_activities" in includes
+
+    # id and is_number are always loaded, they drive the cursor and the nested loads
+    columns = {"id", "is_number", *requested_fields}
+    query = (
+        select(models.FireExtinguisher)
+        .options(load_only(*[getattr(models.FireExtinguisher, name) for name in columns]))
+        .where(models.FireExtinguisher.admin_id == admin_id)
+    )
+    if include_images:
+        query = query.options(*fire_extinguisher_history_options())
+    elif include_activities:
+        query = query.options(selectinload(models.FireExtinguisher.monthly_activities))
+    if after is not None:
+        query = query.where(models.FireExtinguisher.id > after)
+
+    # One extra row tells whether another page exists
+    result = await db.execute(query.order_by(models.FireExtinguisher.id).limit(limit + 1))
+    fire_extinguishers = result.scalars().all()
+    next_cursor = None
+    if len(fire_extinguishers) > limit:
+        fire_extinguishers = fire_extinguishers[:limit]
+        next_cursor = fire_extinguishers[-1].id
+
+    activity_schema = schemas.MonthlyActivityResponse if include_images else schemas.MonthlyActivitySummaryResponse
+    items = []
+    for fire_extinguisher in fire_extinguishers:
+        item = {name: getattr(fire_extinguisher, name) for name in requested_fields}
+        if include_activities:
+            item["monthly_activities"] = [
+                activity_schema.model_validate(activity, from_attributes=True)
+                for activity in fire_extinguisher.monthly_activities
+            ]
+        items.append(item)
+
+    return schemas.FireExtinguisherPageResponse(items=items, next_cursor=next_cursor)
+
+
+UPCOMING_WORK_COLUMNS = (
+    models.FireExtinguisher.id,
+    models.FireExtinguisher.is_number,
+    models.FireExtinguisher.type_of_extinguisher,
+    models.FireExtinguisher.location,
+    models.FireExtinguisher.location_tag_number,
+    models.FireExtinguisher.service_provider,
+)
+
+
+def decode_upcoming_cursor(cursor: str):
+    try:
+        cursor_date, cursor_id, cursor_event = cursor.split(":")
+        if cursor_event not in due_dates.DUE_DATE_FIELDS and cursor_event != due_dates.INSPECTION_EVENT:
+            raise ValueError(cursor_event)
+        return datetime.strptime(cursor_date, "%Y-%m-%d").date(), int(cursor_id), cursor_event
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def upcoming_event_select(event: str, filters: list, horizon: date, lower_bound: Optional[date]):
+    # One branch per due date column, every event of an extinguisher is returned, not only the soonest
+    if event == due_dates.INSPECTION_EVENT:
+        # Next inspection is the due_date of the latest inspection, tracked by compliance_status
+        due_column = models.MonthlyActivity.due_date
+        query = (
+            select(*UPCOMING_WORK_COLUMNS, literal(event).label("event"), due_column.label("due_date"))
+            .join(models.ComplianceStatus, models.ComplianceStatus.is_number == models.FireExtinguisher.is_number)
+            .join(models.MonthlyActivity, models.MonthlyActivity.id == models.ComplianceStatus.latest_activity_id)
+        )
+    else:
+        due_column = getattr(models.FireExtinguisher, due_dates.DUE_DATE_FIELDS[event])
+        query = select(*UPCOMING_WORK_COLUMNS, literal(event).label("event"), due_column.label("due_date"))
+    query = query.where(*filters, due_column <= horizon)
+    if lower_bound is not None:
+        query = query.where(due_column >= lower_bound)
+    return query
+
+
+@router.get("/upcoming/{admin_id}", response_model=schemas.UpcomingWorkPageResponse)
+async def list_upcoming_work(
+    admin_id: int,
+    days: int = Query(30, ge=0, le=3650, description="Window in days from today"),
+    include_overdue: bool = Query(True, description="Also return items whose due date has already passed"),
+    location: Optional[str] = Query(None),
+    service_provider: Optional[str] = Query(None),
+    event: Optional[str] = Query(None, pattern="^(refilling|hpt|expiry|inspection)$"),
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[str] = Query(None, description="Cursor returned as next_cursor by the previous page"),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    # One item per (extinguisher, event) due inside the window, soonest first
+    today = date.today()
+    horizon = today + timedelta(days=days)
+    after_key = decode_upcoming_cursor(after) if after else None
+
+    # next_due_date is the soonest event, so an extinguisher with any event before the horizon has
+    # next_due_date <= horizon: a safe prefilter served by the (admin_id, [location|service_provider,]
+    # next_due_date, id) indexes before each due date column is checked
+    filters = [
+        models.FireExtinguisher.admin_id == admin_id,
+        models.FireExtinguisher.next_due_date <= horizon,
+    ]
+    if location:
+        filters.append(models.FireExtinguisher.location == location)
+    if service_provider:
+        filters.append(models.FireExtinguisher.service_provider == service_provider)
+
+    # Each branch only reads rows at or after the page start; the exact keyset comparison is applied below
+    lower_bounds = [bound for bound in (None if include_overdue else today, after_key[0] if after_key else None) if bound]
+    lower_bound = max(lower_bounds) if lower_bounds else None
+    events = [event] if event else [*due_dates.DUE_DATE_FIELDS, due_dates.INSPECTION_EVENT]
+    upcoming = union_all(
+        *[upcoming_event_select(name, filters, horizon, lower_bound) for name in events]
+    ).subquery()
+
+    query = select(upcoming)
+    if after_key:
+        query = query.where(tuple_(upcoming.c.due_date, upcoming.c.id, upcoming.c.event) > after_key)
+
+    # One extra row tells whether another page exists
+    result = await db.execute(
+        query.order_by(upcoming.c.due_date, upcoming.c.id, upcoming.c.event).limit(limit + 1)
+    )
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1].due_date.isoformat()}:{rows[-1].id}:{rows[-1].event}"
+
+    return schemas.UpcomingWorkPageResponse(
+        items=[schemas.UpcomingWorkItem.model_validate(row, from_attributes=True) for row in rows],
+        next_cursor=next_cursor,
+    )
+
+
+@router.get("/analytics/{admin_id}", response_model=schemas.MeasurementAnalyticsResponse)
+async def measurement_analytics(
+    admin_id: int,
+    start_date: Optional[date] = Query(None, description="Inspections on or after this date (YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="Inspections on or before this date (YYYY-MM-DD)"),
+    weight_loss_pct: float = Query(10.0, ge=0, description="Flag extinguishers that lost at least this % of net weight"),
+    pressure_drift_bar: float = Query(1.0, ge=0, description="Flag extinguishers whose pressure varied by at least this much"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    # Weight loss and pressure drift per extinguisher, aggregated by the database over the numeric columns
+    min_weight = func.min(models.MonthlyActivity.weight_kg)
+    min_pressure = func.min(models.MonthlyActivity.pressure_bar)
+    max_pressure = func.max(models.MonthlyActivity.pressure_bar)
+    weight_loss = models.FireExtinguisher.net_weight_kg - min_weight
+    loss_pct = weight_loss * 100 / func.nullif(models.FireExtinguisher.net_weight_kg, 0)
+    drift = max_pressure - min_pressure
+
+    query = (
+        select(
+            models.FireExtinguisher.is_number,
+            models.FireExtinguisher.location,
+            models.FireExtinguisher.net_weight_kg,
+            func.count(models.MonthlyActivity.id).label("inspections"),
+            func.min(models.MonthlyActivity.inspection_date).label("first_inspection"),
+            func.max(models.MonthlyActivity.inspection_date).label("last_inspection"),
+            min_weight.label("min_weight_kg"),
+            weight_loss.label("weight_loss_kg"),
+            loss_pct.label("weight_loss_pct"),
+            min_pressure.label("min_pressure_bar"),
+            max_pressure.label("max_pressure_bar"),
+            drift.label("pressure_drift_bar"),
+        )
+        .join(models.MonthlyActivity, models.MonthlyActivity.is_number == models.FireExtinguisher.is_number)
+        .where(models.FireExtinguisher.admin_id == admin_id)
+    )
+    if start_date:
+        query = query.where(models.MonthlyActivity.inspection_date >= start_date)
+    if end_date:
+        query = query.where(models.MonthlyActivity.inspection_date <= end_date)
+    query = (
+        query.group_by(
+            models.FireExtinguisher.id,
+            models.FireExtinguisher.is_number,
+            models.FireExtinguisher.location,
+            models.FireExtinguisher.net_weight_kg,
+        )
+        .having((loss_pct >= weight_loss_pct) | (drift >= pressure_drift_bar))
+        .order_by(func.coalesce(loss_pct, -1).desc(), func.coalesce(drift, -1).desc())
+        .limit(limit)
+    )
+
+    result = await db.execute(query)
+    return schemas.MeasurementAnalyticsResponse(
+        weight_loss_pct_threshold=weight_loss_pct,
+        pressure_drift_bar_threshold=pressure_drift_bar,
+        items=[schemas.MeasurementAnalyticsItem.model_validate(row, from_attributes=True) for row in result],
+    )
+
+
+# Rollup dimension -> DashboardResponse field
+DASHBOARD_FIELDS = {
+    "type_of_extinguisher": "by_type",
+    "location": "by_location",
+    "service_provider": "by_service_provider",
+    rollups.COMPLIANCE: "by_compliance",
+    rollups.INSPECTION_MONTH: "inspections_per_month",
+}
+
+
+@router.get("/dashboard/{admin_id}", response_model=schemas.DashboardResponse)
+async def read_dashboard(admin_id: int, db: AsyncSession = Depends(get_async_read_db)):
+    # A single primary-key range read of the precomputed counters, independent of the fleet size
+    result = await db.execute(
+        select(models.DashboardRollup.dimension, models.DashboardRollup.key, models.DashboardRollup.count)
+        .where(models.DashboardRollup.admin_id == admin_id, models.DashboardRollup.count > 0)
+    )
+    dashboard = {field: {} for field in DASHBOARD_FIELDS.values()}
+    for dimension, key, count in result:
+        if dimension in DASHBOARD_FIELDS:
+            dashboard[DASHBOARD_FIELDS[dimension]][key] = count
+    dashboard["inspections_per_month"] = dict(sorted(dashboard["inspections_per_month"].items()))
+    return schemas.DashboardResponse(total=sum(dashboard["by_type"].values()), **dashboard)
+
+
+# Columns matched by /search, each covered by a trigram index on PostgreSQL
+SEARCH_COLUMNS = (
+    models.FireExtinguisher.is_number,
+    models.FireExtinguisher.cylinder_number,
+    models.FireExtinguisher.location_tag_number,
+    models.FireExtinguisher.location,
+    models.FireExtinguisher.service_provider,
+)
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+@router.get("/search/{admin_id}", response_model=schemas.SearchResponse)
+async def search_fire_extinguishers(
+    admin_id: int,
+    q: str = Query(..., min_length=2, max_length=50, description="Part of a location, tag, serial, IS number or provider"),
+    skip: int = Query(0, ge=0, le=10000),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_read_db),
+):
+    term = q.strip()
+    escaped = escape_like(term)
+    # Exact matches first, then prefix matches, then anywhere in the text
+    rank = case(
+        (or_(*[func.lower(column) == term.lower() for column in SEARCH_COLUMNS]), 0),
+        (or_(*[column.ilike(f"{escaped}%", escape="\\") for column in SEARCH_COLUMNS]), 1),
+        else_=2,
+    )
+    query = (
+        select(
+            models.FireExtinguisher.id,
+            models.FireExtinguisher.is_number,
+            models.FireExtinguisher.cylinder_number,
+            models.FireExtinguisher.type_of_extinguisher,
+            models.FireExtinguisher.location,
+            models.FireExtinguisher.location_tag_number,
+            models.FireExtinguisher.service_provider,
+            rank.label("rank"),
+        )
+        .where(
+            models.FireExtinguisher.admin_id == admin_id,
+            or_(*[column.ilike(f"%{escaped}%", escape="\\") for column in SEARCH_COLUMNS]),
+        )
+        .order_by(rank, models.FireExtinguisher.is_number)
+        .offset(skip)
+        .limit(limit + 1)
+    )
+
+    # One extra row tells whether another page exists
+    result = await db.execute(query)
+    rows = result.all()
+    return schemas.SearchResponse(
+        items=[schemas.SearchHit.model_validate(row, from_attributes=True) for row in rows[:limit]],
+        has_more=len(rows) > limit,
+    )
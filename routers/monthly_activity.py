@@ -1,15 +1,33 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from collections import Counter
+from datetime import date
+import logging
+import io
 import schemas
 import models
-from dependencies import get_db
-from typing import List, Dict, Any
+import compliance
+import due_dates
+import measurements
+import rollups
+import storage
+import images
+import exporter
+from dependencies import get_db, get_async_db, get_read_db
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
 @router.post("/", response_model=schemas.MonthlyActivityResponse)
-async def create_monthly_activity(monthly_activity: schemas.MonthlyActivityCreate, db: Session = Depends(get_db)):
+def create_monthly_activity(monthly_activity: schemas.MonthlyActivityCreate, db: Session = Depends(get_db)):
     # Ensure the FireExtinguisher with the given IS number exists
     db_fire_extinguisher = db.query(models.FireExtinguisher).filter(models.FireExtinguisher.is_number == monthly_activity.is_number).first()
 
@@ -18,9 +36,13 @@ async def create_monthly_activity(monthly_activity: schemas.MonthlyActivityCreat
 
     # Create the MonthlyActivity instance
     db_monthly_activity = models.MonthlyActivity(**monthly_activity.model_dump())
+    measurements.apply_activity_measurements(db_monthly_activity)
 
-    # Add and commit the instance to the database
+    # Add and commit the instance to the database together with the refreshed compliance status
     db.add(db_monthly_activity)
+    rollups.apply_deltas(db, rollups.inspection_delta(db_fire_extinguisher.admin_id, db_monthly_activity.inspection_date))
+    compliance.refresh_compliance(db, [db_monthly_activity.is_number])
+    due_dates.refresh_next_due(db, [db_monthly_activity.is_number])
     db.commit()
 
     # Refresh to get the generated ID and other defaults
@@ -29,29 +51,285 @@ async def create_monthly_activity(monthly_activity: schemas.MonthlyActivityCreat
     return db_monthly_activity
 
 
+def insert_activity_batch(db: Session, records: List[schemas.MonthlyActivityBatchItem]) -> List[schemas.MonthlyActivityBatchResult]:
+    results: Dict[int, schemas.MonthlyActivityBatchResult] = {}
+
+    # Records already stored by an earlier attempt of the same sync
+    keys = {record.idempotency_key for record in records if record.idempotency_key}
+    stored_keys = dict(
+        db.query(models.MonthlyActivity.idempotency_key, models.MonthlyActivity.id)
+        .filter(models.MonthlyActivity.idempotency_key.in_(keys))
+        .all()
+    ) if keys else {}
+
+    # One lookup for every extinguisher referenced by the batch
+    admin_ids = dict(
+        db.query(models.FireExtinguisher.is_number, models.FireExtinguisher.admin_id)
+        .filter(models.FireExtinguisher.is_number.in_({record.is_number for record in records}))
+        .all()
+    )
+
+    pending = []
+    pending_keys = {}
+    for index, record in enumerate(records):
+        key = record.idempotency_key
+        if key in stored_keys:
+            results[index] = schemas.MonthlyActivityBatchResult(index=index, status="duplicate", id=stored_keys[key], idempotency_key=key)
+        elif key in pending_keys:
+            # Repeated within this batch: resolved to the id of its first occurrence below
+            results[index] = schemas.MonthlyActivityBatchResult(index=index, status="duplicate", idempotency_key=key)
+        elif record.is_number not in admin_ids:
+            results[index] = schemas.MonthlyActivityBatchResult(
+                index=index, status="error", idempotency_key=key,
+                detail="FireExtinguisher with the given IS number not found.",
+            )
+        else:
+            if key:
+                pending_keys[key] = index
+            pending.append((index, record))
+
+    if pending:
+        # Multi-row INSERT ... RETURNING, ids come back in parameter order
+        ids = db.scalars(
+            insert(models.MonthlyActivity).returning(models.MonthlyActivity.id, sort_by_parameter_order=True),
+            [{**record.model_dump(), **measurements.activity_measurements(record)} for _, record in pending],
+        ).all()
+        for (index, record), activity_id in zip(pending, ids):
+            results[index] = schemas.MonthlyActivityBatchResult(
+                index=index, status="created", id=activity_id, idempotency_key=record.idempotency_key,
+            )
+        deltas = Counter()
+        for _, record in pending:
+            deltas.update(rollups.inspection_delta(admin_ids[record.is_number], record.inspection_date))
+        rollups.apply_deltas(db, deltas)
+        compliance.refresh_compliance(db, [record.is_number for _, record in pending])
+        due_dates.refresh_next_due(db, [record.is_number for _, record in pending])
+
+    for result in results.values():
+        if result.status == "duplicate" and result.id is None:
+            result.id = results[pending_keys[result.idempotency_key]].id
+    return [results[index] for index in range(len(records))]
+
+
+# Unique index on MonthlyActivity.idempotency_key; Postgres names it in the error, SQLite names the column
+IDEMPOTENCY_KEY_CONFLICTS = ("ix_monthlyactivity_idempotency_key", "monthlyactivity.idempotency_key")
+# Attempts of a batch that keeps colliding with concurrent retries of the same sync before giving up
+BATCH_ATTEMPTS = 3
+
+
+def is_idempotency_conflict(error: IntegrityError) -> bool:
+    message = str(error.orig)
+    return any(name in message for name in IDEMPOTENCY_KEY_CONFLICTS)
+
+
+@router.post("/batch", response_model=schemas.MonthlyActivityBatchResponse)
+def create_monthly_activity_batch(batch: schemas.MonthlyActivityBatchCreate, db: Session = Depends(get_db)):
+    # Offline-synced inspections from a mobile device, stored in a single transaction.
+    # Records carrying an idempotency key that is already stored are reported as duplicates, not inserted again.
+    for attempt in range(1, BATCH_ATTEMPTS + 1):
+        try:
+            results = insert_activity_batch(db, batch.records)
+            db.commit()
+            break
+        except IntegrityError as e:
+            db.rollback()
+            if not is_idempotency_conflict(e):
+                # e.g. an extinguisher deleted while the batch was being stored
+                logger.info(f"Monthly activity batch rejected: {str(e.orig)}")
+                raise HTTPException(status_code=409, detail="The batch conflicts with the stored data, nothing was saved")
+            # A concurrent retry of the same sync stored some keys first; run again against the committed rows
+            logger.info(f"Idempotency key conflict in monthly activity batch, attempt {attempt} of {BATCH_ATTEMPTS}")
+    else:
+        raise HTTPException(status_code=409, detail="The batch is being synced concurrently, nothing was saved; retry later")
+
+    return schemas.MonthlyActivityBatchResponse(
+        created=sum(result.status == "created" for result in results),
+        duplicates=sum(result.status == "duplicate" for result in results),
+        failed=sum(result.status == "error" for result in results),
+        results=results,
+    )
+
+
 @router.post("/upload-images/{monthly_activity_id}")
-async def upload_images(monthly_activity_id: int, files: List[UploadFile] = File(...), db: Session = Depends(get_db)):
-    monthly_activity = db.query(models.MonthlyActivity).filter(models.MonthlyActivity.id == monthly_activity_id).first()
+async def upload_images(
+    monthly_activity_id: int,
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_async_db),
+    blob_store: storage.BlobStore = Depends(storage.get_blob_store),
+):
+    monthly_activity = await db.get(models.MonthlyActivity, monthly_activity_id)
     
     if not monthly_activity:
         return {"error": "MonthlyActivity not found"}
     
+    # Stream every file into the blob store; the database only keeps its metadata
+    new_images = []
     for file in files:
-        image_data = await file.read()
+        # GPS position and camera details are removed before the photo reaches the store. Pillow, hashing
+        # and disk writes all run in the threadpool so large photos do not block the event loop.
+        source = await run_in_threadpool(storage.strip_image_metadata, file.file)
+        blob = await run_in_threadpool(blob_store.save_file, source)
         new_image = models.MonthlyActivityImage(
             monthly_activity_id=monthly_activity_id,
-            image_data=image_data,
             description=file.filename  # Optional: store filename as description
         )
+        # Pillow reads the stored header from disk, keep it off the event loop
+        await run_in_threadpool(storage.apply_blob_metadata, new_image, blob_store, blob)
         db.add(new_image)
+        new_images.append(new_image)
     
-    db.commit()
+    await db.commit()
+
+    # Thumbnails are rendered by the image worker pool after the response is returned
+    images.schedule_variants([image.id for image in new_images if image.mime_type in storage.IMAGE_MIME_TYPES])
     return {"message": "Images uploaded successfully"}
 
 
+# Image content never changes for a given id, so clients may cache it for a year
+IMAGE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def parse_range(range_header: str, size: int):
+    # Returns (start, end) for a single byte range, or None when the header should be ignored
+    if not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if not start_text:
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def iter_blob(blob, start: int, length: int):
+    try:
+        blob.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = blob.read(min(storage.CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        blob.close()
+
+
+@router.get("/images/{image_id}")
+def read_image(
+    image_id: int,
+    request: Request,
+    variant: str = Query("original", pattern="^(original|thumbnail|medium)$"),
+    db: Session = Depends(get_db),
+    blob_store: storage.BlobStore = Depends(storage.get_blob_store),
+):
+    # Only metadata is loaded here, image bytes stay deferred
+    image = db.query(models.MonthlyActivityImage).filter(models.MonthlyActivityImage.id == image_id).first()
+
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    cache_control = IMAGE_CACHE_CONTROL
+    # Rows stored before types were detected may still carry a client supplied type
+    media_type = storage.safe_mime_type(image.mime_type)
+    image_variant = None
+    if variant != "original":
+        image_variant = (
+            db.query(models.MonthlyActivityImageVariant)
+            .filter(
+                models.MonthlyActivityImageVariant.image_id == image_id,
+                models.MonthlyActivityImageVariant.variant == variant,
+            )
+            .first()
+        )
+        if image_variant is None:
+            # Variant not rendered yet: serve the original but make clients revalidate later
+            cache_control = "no-cache"
+
+    if image_variant is not None:
+        etag, size, media_type = f'"{image_variant.sha256}"', image_variant.size, image_variant.mime_type
+        open_blob = lambda: blob_store.open(image_variant.sha256)
+    elif image.sha256 is not None:
+        etag, size = f'"{image.sha256}"', image.size
+        open_blob = lambda: blob_store.open(image.sha256)
+    else:
+        # Legacy image still stored inline until migrate-blobs has run. Its content never changes either, so
+        # the row id is enough for the ETag; the bytes are only loaded once a body has to be sent.
+        etag, size = f'"legacy-{image.id}"', None
+        open_blob = lambda: io.BytesIO(image.image_data)
+
+    # nosniff stops browsers from guessing a more dangerous type from the bytes
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes", "X-Content-Type-Options": "nosniff"}
+
+    # A cached copy is still valid, answer without touching the blob
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if size is None:
+        size = db.query(func.length(models.MonthlyActivityImage.image_data)).filter(models.MonthlyActivityImage.id == image_id).scalar() or 0
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        byte_range = parse_range(range_header, size)
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_blob(open_blob(), 0, size), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_blob(open_blob(), start, end - start + 1), status_code=206, media_type=media_type, headers=headers
+    )
+
+
+@router.get("/export")
+def export_monthly_activity(
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    admin_id: Optional[int] = Query(None, description="Only extinguishers registered by this admin"),
+    start_date: Optional[date] = Query(None, description="Inspections on or after this date (YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(None, description="Inspections on or before this date (YYYY-MM-DD)"),
+    type_of_extinguisher: Optional[str] = Query(None),
+):
+    # Full inspection history for audits, streamed from a server-side cursor in constant memory
+    if format == "parquet" and not exporter.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow to be installed")
+
+    query = exporter.export_query(admin_id, start_date, end_date, type_of_extinguisher)
+    filename = f"inspections-{date.today().isoformat()}.{format}"
+    return StreamingResponse(
+        exporter.STREAMERS[format](query),
+        media_type=exporter.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.get("/", response_model=List[schemas.MonthlyActivityResponse])
-async def get_all_monthly_activity(db: Session = Depends(get_db)):
-    all_monthly_activity = db.query(models.MonthlyActivity).all()
+def get_all_monthly_activity(db: Session = Depends(get_read_db)):
+    all_monthly_activity = (
+        db.query(models.MonthlyActivity)
+        .options(selectinload(models.MonthlyActivity.images).selectinload(models.MonthlyActivityImage.variants))
+        .all()
+    )
     
     return all_monthly_activity
 
@@ -74,6 +352,9 @@ def perform_additional_info_update(db: Session, activity_id: int, new_info: Dict
     # Update additional_info with new_info
     activity.additional_info = {**activity.additional_info, **new_info}
 
+    # Acknowledged defects may change the compliance status of the extinguisher
+    compliance.refresh_compliance(db, [activity.is_number])
+
     # Commit the changes to the database
     db.commit()
     
@@ -84,13 +365,18 @@ def perform_additional_info_update(db: Session, activity_id: int, new_info: Dict
 
 
 @router.delete("/{activity_id}", response_model=schemas.MonthlyActivityResponse)
-async def delete_monthly_activity(activity_id: int, db: Session = Depends(get_db)):
+def delete_monthly_activity(activity_id: int, db: Session = Depends(get_db)):
     db_monthly_activity = db.query(models.MonthlyActivity).filter(models.MonthlyActivity.id == activity_id).first()
     
     if not db_monthly_activity:
         raise HTTPException(status_code=404, detail="MonthlyActivity with the given ID not found.")
     
+    rollups.apply_deltas(db, rollups.inspection_delta(
+        db_monthly_activity.fire_extinguisher.admin_id, db_monthly_activity.inspection_date, -1
+    ))
     db.delete(db_monthly_activity)
+    compliance.refresh_compliance(db, [db_monthly_activity.is_number])
+    due_dates.refresh_next_due(db, [db_monthly_activity.is_number])
     db.commit()
     
     return db_monthly_activity
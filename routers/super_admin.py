@@ -1,10 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Request
 from utils import create_access_token, blacklist_token, is_token_blacklisted
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from dependencies import get_db
+from dependencies import get_db, get_async_db, get_current_super_admin, SUPER_ADMIN_SCOPE
+from database import engine
+from passwords import verify_and_upgrade
 import models
 import schemas
+import slow_queries
+from config import settings
 from datetime import timedelta
 import logging
 
@@ -33,8 +39,8 @@ def create_super_admin(super_admin_create: schemas.SuperAdminCreate, db: Session
     return schemas.SuperAdminResponse(id=new_super_admin.id, username=new_super_admin.username)
 
 @router.post("/login", response_model=schemas.SuperAdminToken)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    admin = authenticate_admin(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    admin = await authenticate_admin(db, form_data.username, form_data.password)
     if not admin:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -43,7 +49,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         )
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
-        data={"sub": admin.username}, expires_delta=access_token_expires
+        data={"sub": admin.username, "scope": SUPER_ADMIN_SCOPE}, expires_delta=access_token_expires
     )
     return {
         "access_token": access_token,
@@ -52,18 +58,19 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         "username": admin.username  # Include the username in the response
     }
 
-def authenticate_admin(db: Session, username: str, password: str):
-    admin = db.query(models.SuperAdmin).filter(models.SuperAdmin.username == username).first()
+async def authenticate_admin(db: AsyncSession, username: str, password: str):
+    result = await db.execute(select(models.SuperAdmin).where(models.SuperAdmin.username == username))
+    admin = result.scalars().first()
     if not admin:
         logger.info(f"Admin not found for username: {username}")
         return False
-    if not admin.check_password(password):
+    if not await verify_and_upgrade(db, admin, password):
         logger.info(f"Password mismatch for username: {username}")
         return False
     return admin
 
 @router.post("/logout")
-async def logout(token: str = Depends(oauth2_scheme_admin)):
+def logout(token: str = Depends(oauth2_scheme_admin)):
     if is_token_blacklisted(token):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -73,7 +80,7 @@ async def logout(token: str = Depends(oauth2_scheme_admin)):
     return {"msg": "Logged out successfully"}
 
 @router.get("/protected")
-async def protected_route(request: Request, db: Session = Depends(get_db)):
+def protected_route(request: Request, db: Session = Depends(get_db)):
     token = request.headers.get("Authorization")
     if token and token.startswith("Bearer "):
         token = token[len("Bearer "):]
@@ -83,4 +90,27 @@ async def protected_route(request: Request, db: Session = Depends(get_db)):
             detail="Token is blacklisted or missing",
         )
     # Your endpoint logic here
-    return {"message": "This is a protected route"}
\ No newline at end of file
+    return {"message": "This is a protected route"}
+
+@router.get("/slow-queries", response_model=schemas.SlowQueryReport)
+def slow_query_report(
+    explain: bool = False,
+    current_super_admin: models.SuperAdmin = Depends(get_current_super_admin),
+):
+    # Plain def: EXPLAIN runs blocking queries, keep them in the threadpool
+    if explain and not settings.SLOW_QUERY_EXPLAIN:
+        raise HTTPException(status_code=400, detail="EXPLAIN capture is disabled (SLOW_QUERY_EXPLAIN)")
+    entries = [schemas.SlowQueryEntry(**vars(entry)) for entry in slow_queries.slow_query_log.snapshot()]
+    worst = slow_queries.worst_offenders(engine) if explain else []
+    return schemas.SlowQueryReport(
+        enabled=settings.SLOW_QUERY_ENABLED,
+        threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS,
+        entries=entries,
+        worst=worst,
+    )
+
+@router.delete("/slow-queries")
+def clear_slow_queries(current_super_admin: models.SuperAdmin = Depends(get_current_super_admin)):
+    slow_queries.slow_query_log.clear()
+    logger.info(f"Slow query log cleared by: {current_super_admin.username}")
+    return {"msg": "Slow query log cleared"}
@@ -1,5 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 from datetime import date, timedelta
@@ -7,7 +9,8 @@ import logging
 
 import models
 import schemas
-from dependencies import get_db
+from dependencies import get_db, get_async_db, get_async_read_db
+from passwords import hash_password, verify_and_upgrade
 from utils import create_access_token, blacklist_token, is_token_blacklisted
 
 logger = logging.getLogger(__name__)
@@ -18,8 +21,8 @@ router = APIRouter()
 oauth2_scheme_user = OAuth2PasswordBearer(tokenUrl="/users/login")
 
 @router.post("/login", response_model=schemas.UserToken)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -32,18 +35,19 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     return {"access_token": access_token, "token_type": "bearer", "username": user.username}
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(models.User).filter(models.User.username == username).first()
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    user = result.scalars().first()
     if not user:
         logger.info(f"User not found for username: {username}")
         return False
-    if not user.check_password(password):
+    if not await verify_and_upgrade(db, user, password):
         logger.info(f"Password mismatch for username: {username}")
         return False
     return user
 
 @router.post("/logout")
-async def logout(token: str = Depends(oauth2_scheme_user)):
+def logout(token: str = Depends(oauth2_scheme_user)):
     if is_token_blacklisted(token):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -53,8 +57,9 @@ async def logout(token: str = Depends(oauth2_scheme_user)):
     return {"msg": "Logged out successfully"}
 
 @router.post("/", response_model=schemas.UserResponse)
-async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select(models.User).where(models.User.username == user.username))
+    db_user = result.scalars().first()
     if db_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already registered")
     
@@ -67,21 +72,21 @@ async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         created_at=date.today(),
         updated_at=date.today()
     )
-    new_user.set_password(user.password)
+    new_user.hashed_password = await hash_password(user.password)
     new_user.encrypt_aadhaar(user.aadhaar)
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @router.get("/", response_model=List[schemas.UserResponse])
-async def read_users(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    users = db.query(models.User).offset(skip).limit(limit).all()
-    return users
+async def read_users(skip: int = 0, limit: int = 10, db: AsyncSession = Depends(get_async_read_db)):
+    result = await db.execute(select(models.User).offset(skip).limit(limit))
+    return result.scalars().all()
 
 @router.get("/protected")
-async def protected_route(request: Request, db: Session = Depends(get_db)):
+def protected_route(request: Request, db: Session = Depends(get_db)):
     token = request.headers.get("Authorization")
     if token and token.startswith("Bearer "):
         token = token[len("Bearer "):]
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from datetime import date
+from pydantic import BaseModel, Field, computed_field
+from datetime import date, datetime
 from typing import Optional, List, Dict, Any, Optional
 
 
@@ -126,6 +126,115 @@ class FireExtinguisherResponse(FireExtinguisherBase):
         from_attributes = True
 
 
+class ImportRowError(BaseModel):
+    row: int
+    errors: List[str]
+
+
+class FireExtinguisherImportResponse(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[ImportRowError] = []
+
+
+class FireExtinguisherPageResponse(BaseModel):
+    items: List[Dict[str, Any]] = []
+    next_cursor: Optional[int] = None
+
+
+class UpcomingWorkItem(BaseModel):
+    id: int
+    is_number: str
+    type_of_extinguisher: str
+    location: str
+    location_tag_number: str
+    service_provider: str
+    event: str  # refilling, hpt, expiry or inspection
+    due_date: date
+
+    class Config:
+        from_attributes = True
+
+
+class UpcomingWorkPageResponse(BaseModel):
+    items: List[UpcomingWorkItem] = []
+    next_cursor: Optional[str] = None
+
+
+class MeasurementAnalyticsItem(BaseModel):
+    is_number: str
+    location: str
+    net_weight_kg: Optional[float] = None
+    inspections: int
+    first_inspection: date
+    last_inspection: date
+    min_weight_kg: Optional[float] = None
+    weight_loss_kg: Optional[float] = None
+    weight_loss_pct: Optional[float] = None
+    min_pressure_bar: Optional[float] = None
+    max_pressure_bar: Optional[float] = None
+    pressure_drift_bar: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
+
+class MeasurementAnalyticsResponse(BaseModel):
+    weight_loss_pct_threshold: float
+    pressure_drift_bar_threshold: float
+    items: List[MeasurementAnalyticsItem] = []
+
+
+class DashboardResponse(BaseModel):
+    total: int = 0
+    by_type: Dict[str, int] = {}
+    by_location: Dict[str, int] = {}
+    by_service_provider: Dict[str, int] = {}
+    by_compliance: Dict[str, int] = {}
+    inspections_per_month: Dict[str, int] = {}
+
+
+class SlowQueryEntry(BaseModel):
+    statement: str
+    parameters: Any = None  # parameter names/positions with type names, values are redacted
+    duration_ms: float
+    executemany: bool
+    recorded_at: datetime
+
+
+class SlowQueryOffender(BaseModel):
+    statement: str
+    duration_ms: float
+    plan: Optional[str] = None
+    error: Optional[str] = None
+
+
+class SlowQueryReport(BaseModel):
+    enabled: bool
+    threshold_ms: int
+    entries: List[SlowQueryEntry] = []
+    worst: List[SlowQueryOffender] = []
+
+
+class SearchHit(BaseModel):
+    id: int
+    is_number: str
+    cylinder_number: str
+    type_of_extinguisher: str
+    location: str
+    location_tag_number: str
+    service_provider: str
+    rank: int  # 0 exact match, 1 prefix match, 2 substring match
+
+    class Config:
+        from_attributes = True
+
+
+class SearchResponse(BaseModel):
+    items: List[SearchHit] = []
+    has_more: bool = False
+
+
 class FireExtinguisherSummaryResponse(BaseModel):
     sl_no: int  # This could be a calculated field based on the index in the response
     serial_no: str
@@ -144,6 +253,21 @@ class FireExtinguisherSummaryResponse(BaseModel):
         form_attributes = True
 
 
+class ComplianceReportResponse(BaseModel):
+    admin_id: int
+    as_of: date
+    total: int
+    compliant: int
+    non_compliant: int
+    overdue_refilling: int
+    overdue_hpt: int
+    expired: int
+    non_compliant_serials: List[str] = []
+    overdue_refilling_serials: List[str] = []
+    overdue_hpt_serials: List[str] = []
+    expired_serials: List[str] = []
+
+
 class MonthlyActivityBase(BaseModel):
     is_number: str
     inspection_date: date
@@ -168,9 +292,67 @@ class MonthlyActivityCreate(MonthlyActivityBase):
     pass
 
 
+class MonthlyActivityBatchItem(MonthlyActivityCreate):
+    idempotency_key: Optional[str] = Field(None, min_length=1, max_length=64)
+
+
+class MonthlyActivityBatchCreate(BaseModel):
+    records: List[MonthlyActivityBatchItem] = Field(..., min_length=1, max_length=500)
+
+
+class MonthlyActivityBatchResult(BaseModel):
+    index: int
+    status: str  # "created", "duplicate" or "error"
+    id: Optional[int] = None
+    idempotency_key: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class MonthlyActivityBatchResponse(BaseModel):
+    created: int
+    duplicates: int
+    failed: int
+    results: List[MonthlyActivityBatchResult]
+
+
+class MonthlyActivitySummaryResponse(MonthlyActivityBase):
+    id: int
+
+    class Config:
+        from_attributes = True
+
+
+# Image URLs are relative to the API root, served by GET /monthlyactivity/images/{image_id}
+class MonthlyActivityImageVariantResponse(BaseModel):
+    image_id: int
+    variant: str  # thumbnail, medium
+    mime_type: str
+    size: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @computed_field
+    @property
+    def url(self) -> str:
+        return f"/monthlyactivity/images/{self.image_id}?variant={self.variant}"
+
+    class Config:
+        from_attributes = True
+
+
 class MonthlyActivityImageResponse(BaseModel):
     id: int
     description: Optional[str]
+    mime_type: Optional[str] = None
+    size: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    variants: List[MonthlyActivityImageVariantResponse] = []  # Empty until the background worker has rendered them
+
+    @computed_field
+    @property
+    def url(self) -> str:
+        return f"/monthlyactivity/images/{self.id}"
 
     class Config:
         orm_mode = True
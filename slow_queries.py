@@ -0,0 +1,149 @@
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from config import settings
+
+# Quoted literals in plan output ("Filter: (username = 'bob')") are replaced so plans never echo user data
+PLAN_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+EXPLAINABLE_PATTERN = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+
+@dataclass
+class SlowQuery:
+    statement: str
+    parameters: object  # type names only, never values
+    duration_ms: float
+    executemany: bool
+    recorded_at: datetime
+
+
+def redact_parameters(parameters, executemany: bool):
+    # Keep the shape of the bind parameters (names, positions, types) and drop the values
+    if executemany:
+        rows = list(parameters or ())
+        return {"rows": len(rows), "first": redact_parameters(rows[0], False) if rows else None}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return None
+
+
+class SlowQueryLog:
+    # Ring buffer of the most recent slow statements plus, per distinct statement, the worst execution seen.
+    # The hooks run on whichever thread owns the connection, hence the lock.
+    def __init__(self, buffer_size: int, explain_top: int):
+        self.entries: deque = deque(maxlen=buffer_size)
+        self.explain_top = explain_top
+        # statement -> (worst duration in ms, raw parameters); raw values stay in memory for EXPLAIN only
+        self._worst: Dict[str, Tuple[float, object]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, parameters, duration_ms: float, executemany: bool):
+        entry = SlowQuery(
+            statement=statement,
+            parameters=redact_parameters(parameters, executemany),
+            duration_ms=round(duration_ms, 2),
+            executemany=executemany,
+            recorded_at=datetime.now(timezone.utc),
+        )
+        with self._lock:
+            self.entries.append(entry)
+            if self.explain_top and not executemany and EXPLAINABLE_PATTERN.match(statement):
+                self._remember_worst(statement, parameters, duration_ms)
+
+    def _remember_worst(self, statement: str, parameters, duration_ms: float):
+        current = self._worst.get(statement)
+        if current is not None:
+            if duration_ms > current[0]:
+                self._worst[statement] = (duration_ms, parameters)
+            return
+        if len(self._worst) >= self.explain_top:
+            fastest = min(self._worst, key=lambda key: self._worst[key][0])
+            if self._worst[fastest][0] >= duration_ms:
+                return
+            del self._worst[fastest]
+        self._worst[statement] = (duration_ms, parameters)
+
+    def snapshot(self) -> List[SlowQuery]:
+        # Most recent first
+        with self._lock:
+            return list(reversed(self.entries))
+
+    def worst(self) -> List[Tuple[str, float, object]]:
+        with self._lock:
+            items = [(statement, duration, parameters) for statement, (duration, parameters) in self._worst.items()]
+        return sorted(items, key=lambda item: item[1], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._worst.clear()
+
+
+slow_query_log = SlowQueryLog(settings.SLOW_QUERY_BUFFER_SIZE, settings.SLOW_QUERY_EXPLAIN_TOP if settings.SLOW_QUERY_EXPLAIN else 0)
+
+
+# Timed on the per-statement execution context, like metrics.py, so a failing statement leaves nothing behind
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.slow_query_started_at = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, "slow_query_started_at", None)
+    if started_at is None:
+        return
+    duration_ms = (time.perf_counter() - started_at) * 1000
+    if duration_ms >= settings.SLOW_QUERY_THRESHOLD_MS:
+        slow_query_log.record(statement, parameters, duration_ms, executemany)
+
+
+def explain_prefix(dialect_name: str) -> Optional[str]:
+    if dialect_name == "postgresql":
+        return "EXPLAIN "
+    if dialect_name == "sqlite":
+        return "EXPLAIN QUERY PLAN "
+    return None
+
+
+def explain(engine, statement: str, parameters) -> Optional[str]:
+    # Plans are taken on a fresh connection so a failing EXPLAIN can never abort a request's transaction.
+    # It is never run from the hooks themselves, only when the report is requested.
+    prefix = explain_prefix(engine.dialect.name)
+    if prefix is None:
+        return None
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + statement, parameters).fetchall()
+        connection.rollback()
+    # Postgres returns one plan line per row, SQLite puts the detail in the last column
+    lines = [str(row[-1]) for row in rows]
+    return PLAN_LITERAL_PATTERN.sub("'?'", "\n".join(lines))
+
+
+def worst_offenders(engine) -> List[dict]:
+    offenders = []
+    for statement, duration_ms, parameters in slow_query_log.worst():
+        try:
+            plan = explain(engine, statement, parameters)
+            error = None
+        except Exception as exc:
+            plan, error = None, type(exc).__name__
+        offenders.append({"statement": statement, "duration_ms": round(duration_ms, 2), "plan": plan, "error": error})
+    return offenders
+
+
+def install(*engines):
+    # Nothing is hooked when SLOW_QUERY_ENABLED is off, so the detector costs nothing per query
+    if not settings.SLOW_QUERY_ENABLED:
+        return
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
@@ -0,0 +1,301 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy.orm import Session, undefer
+
+import models
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks read from uploads and written to the store
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class StoredBlob:
+    sha256: str
+    size: int
+
+
+class BlobWriter(ABC):
+    # Accumulates a blob chunk by chunk; the content address is only known once it is committed
+    @abstractmethod
+    def write(self, chunk: bytes):
+        raise NotImplementedError
+
+    @abstractmethod
+    def commit(self) -> StoredBlob:
+        raise NotImplementedError
+
+    @abstractmethod
+    def abort(self):
+        raise NotImplementedError
+
+
+class BlobStore(ABC):
+    # Interface implemented by every storage backend; blobs are addressed by their SHA-256
+    @abstractmethod
+    def writer(self) -> BlobWriter:
+        raise NotImplementedError
+
+    @abstractmethod
+    def open(self, sha256: str) -> BinaryIO:
+        raise NotImplementedError
+
+    @abstractmethod
+    def exists(self, sha256: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, sha256: str):
+        raise NotImplementedError
+
+    def put_bytes(self, data: bytes) -> StoredBlob:
+        return self.save_file(io.BytesIO(data))
+
+    def save_file(self, source: BinaryIO) -> StoredBlob:
+        # Copies a file object into the store chunk by chunk, without holding the whole file in memory.
+        # Blocking: async callers run it through run_in_threadpool.
+        writer = self.writer()
+        try:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        except Exception:
+            writer.abort()
+            raise
+        return writer.commit()
+
+
+class LocalBlobWriter(BlobWriter):
+    def __init__(self, store: "LocalBlobStore"):
+        self.store = store
+        self.digest = hashlib.sha256()
+        self.size = 0
+        fd, self.temp_path = tempfile.mkstemp(dir=store.temp_dir)
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        self.file.write(chunk)
+
+    def commit(self) -> StoredBlob:
+        self.file.close()
+        sha256 = self.digest.hexdigest()
+        path = self.store.path(sha256)
+        if os.path.exists(path):
+            # Same content is already stored, keep a single copy
+            os.remove(self.temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.temp_path, path)
+        return StoredBlob(sha256=sha256, size=self.size)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = root
+        self.temp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def path(self, sha256: str) -> str:
+        # Fan out into two directory levels to keep directories small
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def writer(self) -> BlobWriter:
+        return LocalBlobWriter(self)
+
+    def open(self, sha256: str) -> BinaryIO:
+        return open(self.path(sha256), "rb")
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    def delete(self, sha256: str):
+        if os.path.exists(self.path(sha256)):
+            os.remove(self.path(sha256))
+
+
+BACKENDS = {
+    "local": lambda: LocalBlobStore(settings.BLOB_STORAGE_PATH),
+}
+
+_blob_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    global _blob_store
+    if _blob_store is None:
+        backend = BACKENDS.get(settings.BLOB_STORAGE_BACKEND)
+        if backend is None:
+            raise ValueError(f"Unknown blob storage backend: {settings.BLOB_STORAGE_BACKEND}")
+        _blob_store = backend()
+    return _blob_store
+
+
+# Types served inline; anything else is stored and served as application/octet-stream
+IMAGE_MIME_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff"}
+
+
+def safe_mime_type(mime_type: Optional[str]) -> str:
+    return mime_type if mime_type in IMAGE_MIME_TYPES else "application/octet-stream"
+
+
+def describe_image(store: BlobStore, sha256: str):
+    # Returns (mime_type, width, height); Pillow only reads the header here
+    try:
+        with store.open(sha256) as blob, Image.open(blob) as image:
+            return Image.MIME.get(image.format), image.width, image.height
+    except Exception:
+        return None, None, None
+
+
+# Image.info keys holding EXIF (GPS position, camera serial, capture time), XMP and free-text comments
+IDENTIFYING_INFO_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment", "photoshop")
+EXIF_ORIENTATION = 0x0112
+
+
+def has_identifying_metadata(image: Image.Image) -> bool:
+    if any(key in image.info for key in IDENTIFYING_INFO_KEYS):
+        return True
+    # PNG text chunks, and TIFF where the tags live in the image file directory itself
+    return bool(getattr(image, "text", None)) or image.format == "TIFF"
+
+
+def strip_image_metadata(source: BinaryIO) -> BinaryIO:
+    # Returns a file positioned at its start without EXIF/XMP/comments. The EXIF orientation is applied
+    # to the pixels first; ICC colour profiles are kept. Anything Pillow cannot rewrite comes back as-is.
+    # Blocking: async callers run it through run_in_threadpool.
+    source.seek(0)
+    try:
+        with Image.open(source) as image:
+            if not has_identifying_metadata(image) or getattr(image, "is_animated", False):
+                source.seek(0)
+                return source
+            image_format = image.format
+            options = {}
+            if image.info.get("icc_profile"):
+                options["icc_profile"] = image.info["icc_profile"]
+            if image.getexif().get(EXIF_ORIENTATION, 1) != 1:
+                cleaned = ImageOps.exif_transpose(image)
+                if image_format == "JPEG":
+                    options["quality"] = 95
+            else:
+                cleaned = image
+                if image_format == "JPEG":
+                    # Re-use the original quantization tables, as close to lossless as re-encoding gets
+                    options.update(quality="keep", subsampling="keep")
+            # Without an exif= argument Pillow writes no EXIF block
+            output = tempfile.SpooledTemporaryFile(max_size=8 * CHUNK_SIZE)
+            cleaned.save(output, format=image_format, **options)
+    except UnidentifiedImageError:
+        # Not an image (PDF scan, text note), there is no image metadata to remove
+        source.seek(0)
+        return source
+    except Exception:
+        logger.exception("Could not strip image metadata, storing the file unchanged")
+        source.seek(0)
+        return source
+    output.seek(0)
+    return output
+
+
+def apply_blob_metadata(image: models.MonthlyActivityImage, store: BlobStore, blob: StoredBlob):
+    # The type comes from the bytes as Pillow detects them, never from the client's Content-Type:
+    # an upload labelled text/html must not be served back as HTML from the API origin
+    detected_mime, width, height = describe_image(store, blob.sha256)
+    image.sha256 = blob.sha256
+    image.size = blob.size
+    image.mime_type = safe_mime_type(detected_mime)
+    image.width = width
+    image.height = height
+
+
+def migrate_database_blobs(db: Session, store: BlobStore, batch_size: int = 100) -> int:
+    # Moves image bytes still kept in monthly_activity_images into the blob store, one batch per commit
+    total = 0
+    last_id = 0
+    while True:
+        images = (
+            db.query(models.MonthlyActivityImage)
+            .options(undefer(models.MonthlyActivityImage.image_data))
+            .filter(
+                models.MonthlyActivityImage.id > last_id,
+                models.MonthlyActivityImage.sha256.is_(None),
+                models.MonthlyActivityImage.image_data.isnot(None),
+            )
+            .order_by(models.MonthlyActivityImage.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not images:
+            break
+        for image in images:
+            blob = store.save_file(strip_image_metadata(io.BytesIO(image.image_data)))
+            apply_blob_metadata(image, store, blob)
+            image.image_data = None
+        db.commit()
+        last_id = images[-1].id
+        total += len(images)
+        db.expunge_all()
+        logger.info(f"Migrated {total} images to blob storage")
+    return total
+
+
+def blob_references(db: Session, sha256: str) -> int:
+    return (
+        db.query(models.MonthlyActivityImage).filter(models.MonthlyActivityImage.sha256 == sha256).count()
+        + db.query(models.MonthlyActivityImageVariant).filter(models.MonthlyActivityImageVariant.sha256 == sha256).count()
+    )
+
+
+def strip_stored_metadata(db: Session, store: BlobStore, batch_size: int = 100) -> int:
+    # Rewrites originals stored before metadata stripping; returns how many changed. Blobs that no row
+    # points at afterwards are deleted, content shared with another row is kept.
+    changed = 0
+    last_id = 0
+    while True:
+        images = (
+            db.query(models.MonthlyActivityImage)
+            .filter(models.MonthlyActivityImage.id > last_id, models.MonthlyActivityImage.sha256.isnot(None))
+            .order_by(models.MonthlyActivityImage.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not images:
+            break
+        replaced = set()
+        for image in images:
+            with store.open(image.sha256) as blob:
+                cleaned = strip_image_metadata(blob)
+                if cleaned is blob:
+                    continue
+                with cleaned:
+                    new_blob = store.save_file(cleaned)
+            replaced.add(image.sha256)
+            apply_blob_metadata(image, store, new_blob)
+            changed += 1
+        db.commit()
+        for sha256 in replaced:
+            if blob_references(db, sha256) == 0:
+                store.delete(sha256)
+        last_id = images[-1].id
+        db.expunge_all()
+        logger.info(f"Stripped metadata from {changed} stored images")
+    return changed
@@ -1,10 +1,11 @@
+import hashlib
+import time
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from config import settings
-
-# Token blacklist in-memory store (for simplicity)
-token_blacklist = set()
+from revocation import get_revocation_store
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -12,7 +13,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(hours=1)
-    to_encode.update({"exp": expire})
+    # jti identifies the token in the revocation store
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
@@ -23,8 +25,22 @@ def decode_access_token(token: str):
     except JWTError:
         return None
 
+def token_id(token: str, payload: dict) -> str:
+    # Tokens issued before jti was added are identified by their hash
+    return payload.get("jti") or hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def is_payload_revoked(token: str, payload: dict) -> bool:
+    return get_revocation_store().is_revoked(token_id(token, payload))
+
 def blacklist_token(token: str):
-    token_blacklist.add(token)
+    payload = decode_access_token(token)
+    if payload is None:
+        # Invalid or already expired tokens are rejected anyway, nothing to remember
+        return
+    get_revocation_store().revoke(token_id(token, payload), payload.get("exp", time.time()))
 
 def is_token_blacklisted(token: str) -> bool:
-    return token in token_blacklist
+    payload = decode_access_token(token)
+    if payload is None:
+        return False
+    return is_payload_revoked(token, payload)